@@ -1,13 +1,21 @@
 #! /usr/bin/env python -u
 # coding=utf-8
 import json
+import multiprocessing
 import os
 from collections import OrderedDict
-from exps import Experiment
-from models import get_base_graph
-from oracle import TimeOracle
-from results import ResultAnalyser
-from wizard import TAO, TIO
+from batch_search import BatchSizeSearch, ProbeCache, step_a
+from exps import LOSS_COLLECTION, Experiment
+from graph_cache import GraphCache
+from local_cluster import resolve_master
+from graph_ir import GraphIR
+from oracle import TimeOracle, parse_statistic
+from oracle_store import OracleStore
+from partition_planner import load_plan
+from order_graphs import get_priorities, graph_filename, oracle_filename
+from priority_table import PriorityTable, graph_fingerprint
+from utils import Timer
+from wizard import priority_print
 import tensorflow as tf
 import argparse
 
@@ -26,32 +34,56 @@ def save_json(filename, data):
         return json.dump(data, fp)
 
 
-def priority_print(priority_dict):
-    ret = "std::unordered_map<std::string, int> rpc_list = \n{\n"
-    first = True
-    for name, priority in priority_dict.items():
-        if first:
-            first = False
-        else:
-            ret += ",\n\n"
-        ret += "// {}\n".format(name)
-        ret += ",\n".join(
-            ['{"%s", %s}' % (row[1].op.name[:-5], row[0]) for row in sorted(priority, key=lambda x: x[0])])
-    ret += "\n\n};"
-    return ret
+def extract_ordering(model, algorithm, batch_size, workers, ps_tasks, statistic, partition_plan=None,
+                     graph_cache="graph_cache"):
+    """
+    Takes the replicated graph of one model (with the variables of `partition_plan` partitioned) from the graph
+    cache, as `Experiment` builds and runs it, exports it and returns its scope, priorities, graph fingerprint and
+    build/ordering times. The gradient sends of every worker (`gradients_{i}/...`) get a priority.
+    """
+    scope = "{}-{}".format(model, algorithm)
+    with Timer() as build_timer:
+        Experiment(None, workers, model, algorithm, batch_size, GraphCache(graph_cache), ps_tasks, partition_plan)
+        sends = GraphIR.gradient_sends(tf.get_default_graph().as_graph_def())
+        meta = dict(model=model, algorithm=algorithm, scope=scope, batch_size=batch_size, workers=workers,
+                    ps_tasks=ps_tasks, sends=sends, partition_plan=partition_plan or {})
+        graph = GraphIR.from_tensor(tf.get_collection(LOSS_COLLECTION)[0], meta=meta)
+        graph.save(graph_filename(scope + "-partitioned" if partition_plan else scope))
+    with Timer() as order_timer:
+        priorities = get_priorities(graph, statistic)
+    return scope, priorities, graph_fingerprint(graph), build_timer.elapsed(), order_timer.elapsed()
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("master", help="Master uri e.g grpc://1.2.3.4:2222")
+    parser.add_argument("master", help="Master uri e.g grpc://1.2.3.4:2222, or \"local\" to start a local cluster")
     parser.add_argument("workers", help="Number of workers", type=int)
+    parser.add_argument("-p", "--ps-tasks", help="Number of PS tasks the variables are sharded over", type=int,
+                        default=1)
+    parser.add_argument("--subprocesses", help="Run the local cluster's servers in separate processes",
+                        action="store_true")
+    parser.add_argument("-c", "--graph-cache", help="Directory of the graph build cache", default="graph_cache")
     parser.add_argument("-r", "--repeat", help="Number of repeats per experiment", type=int, default=10)
+    parser.add_argument("-s", "--statistic", help="Op durations used by TAO: min, mean, max or a quantile e.g. 0.9",
+                        type=parse_statistic, default="min")
+    parser.add_argument("--probe-steps", help="Minimum number of steps per batch size probe", type=int, default=3)
+    parser.add_argument("--probe-cache", help="Cache of batch size probes", default="batch_probes.json")
+    parser.add_argument("--oracle-store", help="Database of the time oracles", default="oracles.db")
+    parser.add_argument("--hardware", help="Hardware tag of the cluster, part of the time oracles' key", default="")
+    parser.add_argument("--oracle-max-age", help="Reuse a stored time oracle of the same key if it is not older "
+                                                 "than this (hours)", type=float, default=None)
+    parser.add_argument("--reprofile", help="Profile again and merge into the stored time oracles",
+                        action="store_true")
+    parser.add_argument("--partition-plan", help="Order the models with their variables partitioned as planned by "
+                                                 "partition_planner.py e.g. partition_plan.json")
+    parser.add_argument("-j", "--processes", help="Number of processes used to build the time oracles and orderings",
+                        type=int, default=None)
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     args = parse_args()
-    master = args.master
+    master, cluster = resolve_master(args.master, args.workers, args.subprocesses, args.ps_tasks)
     workers = args.workers
     try_per_step = args.repeat
 
@@ -69,62 +101,69 @@ if __name__ == '__main__':
     batch_size = {model: 10 for model in base_models}
     batch_size.update(load_json(batch_size_filename, {}))
 
+    graph_cache = GraphCache(args.graph_cache)
+    probe_cache = ProbeCache(args.probe_cache)
     for model in base_models:
-        attempts = 10
-        min_size = 1
-        max_step = 100
+        def probe(size):
+            experiment = Experiment(master, workers, model, "none", size, graph_cache, args.ps_tasks)
+            return (step_a(metadata) for _, metadata in experiment.trace("fw"))
 
         print("//{}".format(model))
-        for i in range(attempts):
-            print("Attempt {}:\tbatch_size: {}\t".format(i, batch_size[model]), sep="")
-            result = Experiment(master, workers, model, "none", batch_size[model]).run(try_per_step, ["fw"])[0]
-            a = ResultAnalyser(result).get_a()
-            if 1.1 >= a >= 0.9:
-                print("a={}\t(Final)".format(a))
-                break
-            else:
-                multiplier = min(max_step, a)
-                batch_size[model] = max(min_size, int(batch_size[model] * multiplier))
-                print("a={}\tchange to={}".format(a, batch_size[model]))
+        search = BatchSizeSearch(probe, model, workers, probe_cache, min_steps=args.probe_steps,
+                                 max_steps=try_per_step, ps_tasks=args.ps_tasks)
+        batch_size[model] = search.search(batch_size[model])
+        print("batch_size={}\t(Final)".format(batch_size[model]))
         save_json(batch_size_filename, batch_size)
 
     # Estimate Time Oracle
+    # Stored oracles of the same key are reused only when fresh enough under --oracle-max-age, otherwise the new
+    # profile is merged into them.
+    oracle_store = OracleStore(args.oracle_store)
+    max_age = args.oracle_max_age * 3600 if args.oracle_max_age is not None else None
     for model in base_models:
         print("//{}".format(model))
-        result = Experiment(master, workers, model, "none", batch_size[model]).run(try_per_step, ["fw"])[0]
-        oracle = TimeOracle(scope="{}-{}".format(model, "none"))
-        for m in result.metadata:
-            oracle.update(m)
-        oracle.save("time-oracle-{}.json".format(model))
+        scope = "{}-{}".format(model, "none")
+        key = dict(model=model, batch_size=batch_size[model], workers=workers, ps_tasks=args.ps_tasks,
+                   tf_version=tf.__version__, hardware=args.hardware)
+        entry = None if args.reprofile else oracle_store.fresh(max_age, try_per_step, **key)
+        if entry is not None:
+            print("Time oracle: revision {} ({} steps) reused".format(entry["revision"], entry["steps"]))
+        else:
+            experiment = Experiment(master, workers, model, "none", batch_size[model], graph_cache, args.ps_tasks)
+            result = experiment.run(try_per_step, ["fw"])[0]
+            oracle = TimeOracle(scope=scope)
+            oracle.update_many(result.metadata, processes=args.processes)
+            revision = oracle_store.add(oracle, len(result.metadata), **key)
+            print("Time oracle: revision {}".format(revision))
+        oracle_store.load(scope, **key).save(oracle_filename(model))
+    if cluster is not None:
+        cluster.stop()
+    print(graph_cache)
+
+    # Extract Orderings
+    # Every (model, algorithm) is an independent job; the header is written in the order of the jobs.
+    # Partitioned models are ordered with the time oracles of the unpartitioned ones (see partition_planner.py).
+    jobs = [(model, algorithm, batch_size[model], workers, args.ps_tasks, args.statistic,
+             load_plan(args.partition_plan, model) if args.partition_plan else None, args.graph_cache)
+            for model in base_models for algorithm in ("TAO", "TIO")]
+    with Timer() as timer:
+        if args.processes:
+            # TF does not survive a fork once sessions have run, so the workers are spawned.
+            with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+                orderings = pool.starmap(extract_ordering, jobs)
+        else:
+            orderings = [extract_ordering(*job) for job in jobs]
 
-    # Estimate Time Oracle
     priorities_dict = OrderedDict()
-    for model in base_models:
-        print("//{}".format(model))
-        try:
-            tf.reset_default_graph()
-            scope = "{}-{}".format(model, "TAO")
-            with tf.device(tf.train.replica_device_setter(ps_tasks=1, worker_device="/job:worker/task:0")):
-                loss = get_base_graph(model, batch_size[model], scope=scope)
-            oracle = TimeOracle.load("time-oracle-{}.json".format(model), scope)
-            if oracle:
-                tao = TAO(loss, oracle)
-                priorities = tao.get_priorities()
-                priorities_dict[scope] = priorities
-        finally:
-            pass
-        try:
-            tf.reset_default_graph()
-            scope = "{}-{}".format(model, "TIO")
-            with tf.device(tf.train.replica_device_setter(ps_tasks=1, worker_device="/job:worker/task:0")):
-                loss = get_base_graph(model, batch_size[model], scope=scope)
-            tio = TIO(loss)
-            priorities = tio.get_priorities()
-            priorities_dict[scope] = priorities
-        finally:
-            pass
+    fingerprints = {}
+    for scope, priorities, fingerprint, build_time, order_time in orderings:
+        print("//{}\tbuild: {:0.1f}s\tordering: {:0.1f}s".format(scope, build_time, order_time))
+        priorities_dict[scope] = priorities
+        fingerprints[scope] = fingerprint
+    print("Orderings extracted in {:0.1f}s".format(timer.elapsed()))
 
     with open("rpc_orders.h", "w") as fp:
         fp.write(priority_print(priorities_dict))
+    PriorityTable.from_priorities(priorities_dict, fingerprints).save("rpc_orders.bin")
 
     print('Put `rpc_orders.h` in "tensorflow/core/distributed_runtime/rpc/" and recompile TF.')
@@ -3,10 +3,28 @@
 import argparse
 import json
 import os
-from exps import Experiment
+import time
+from exps import Experiment, trace_interval
+from graph_cache import GraphCache
+from local_cluster import resolve_master
+from manifest import Manifest
+from partition_planner import load_plan
+from trace_store import is_complete
+from utils import Timer
 
 __author__ = 'xl'
 
+BASE_MODELS = (
+    "inception_v3",
+    "resnet_152",
+    "vgg16",
+    "alexnet",
+    "seq-32",
+    "par-32",
+)
+ALGORITHMS = ("none", "TAO", "TIO")
+STAGES = ("fw", "train")
+
 
 def load_json(filename, default_value):
     if os.path.exists(filename):
@@ -20,54 +38,99 @@ def save_json(filename, data):
         return json.dump(data, fp)
 
 
-def priority_print(priority_dict):
-    ret = "std::unordered_map<std::string, int> rpc_list = \n{\n"
-    first = True
-    for name, priority in priority_dict.items():
-        if first:
-            first = False
-        else:
-            ret += ",\n\n"
-        ret += "// {}\n".format(name)
-        ret += ",\n".join(
-            ['{"%s", %s}' % (row[1].op.name[:-5], row[0]) for row in sorted(priority, key=lambda x: x[0])])
-    ret += "\n\n};"
-    return ret
-
-
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("master", help="Master uri e.g grpc://1.2.3.4:2222")
+    parser.add_argument("master", help="Master uri e.g grpc://1.2.3.4:2222, or \"local\" to start a local cluster")
     parser.add_argument("workers", help="Number of workers", type=int)
+    parser.add_argument("-p", "--ps-tasks", help="Number of PS tasks the variables are sharded over", type=int,
+                        default=1)
+    parser.add_argument("--subprocesses", help="Run the local cluster's servers in separate processes",
+                        action="store_true")
+    parser.add_argument("-c", "--graph-cache", help="Directory of the graph build cache", default="graph_cache")
     parser.add_argument("-r", "--repeat", help="Number of repeats per experiment", type=int, default=100)
+    parser.add_argument("--warmup", help="Number of untimed warm-up steps", type=int, default=1)
+    parser.add_argument("--trace-every", help="Trace only every Nth step (others are timed untraced)", type=int,
+                        default=None)
+    parser.add_argument("--trace-budget", help="Maximum number of traced steps, spread over the run", type=int,
+                        default=None)
+    parser.add_argument("-m", "--models", help="Only run these models", nargs="+", choices=BASE_MODELS,
+                        default=BASE_MODELS)
+    parser.add_argument("-a", "--algorithms", help="Only run these orderings", nargs="+", choices=ALGORITHMS,
+                        default=ALGORITHMS)
+    parser.add_argument("--stages", help="Only run these stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--partition-plan", help="Partition the variables of the models as planned by "
+                                                 "partition_planner.py e.g. partition_plan.json")
+    parser.add_argument("--retries", help="Number of retries of a failed experiment", type=int, default=2)
+    parser.add_argument("--backoff", help="Seconds before the first retry (doubled after each failure)", type=float,
+                        default=30)
     return parser.parse_args()
 
 
+def format_time(seconds):
+    return "?" if seconds is None else "{:0.0f}m".format(seconds / 60)
+
+
+def run_cell(cell, master, batch_size, graph_cache, args):
+    plan = load_plan(args.partition_plan, cell["model"]) if args.partition_plan else {}
+    experiment = Experiment(master, args.workers, cell["model"], cell["algorithm"], batch_size, graph_cache,
+                            args.ps_tasks, plan)
+    result, = experiment.run(args.repeat, [cell["stage"]], warmup=args.warmup, trace_every=args.trace_every,
+                             trace_budget=args.trace_budget)
+    result.save_trace(cell["path"])
+
+
 if __name__ == '__main__':
     args = parse_args()
-    master = args.master
     workers = args.workers
-    try_per_step = args.repeat
 
     # Load Batch Sizes
     batch_size_filename = "batch_sizes-{}.json".format(workers)
-    base_models = (
-        "inception_v3",
-        "resnet_152",
-        "vgg16",
-        "alexnet",
-        "seq-32",
-        "par-32",
-    )
-
-    batch_size = {model: 10 for model in base_models}
+    batch_size = {model: 10 for model in BASE_MODELS}
     batch_size.update(load_json(batch_size_filename, {}))
 
-    for model in base_models:
-        for algorithm in ["none", "TAO", "TIO"]:
-            print("//{}-{}".format(model, algorithm))
-            results = Experiment(master, workers, model, algorithm, batch_size[model]).run(try_per_step)
-            for stage, result in zip(["fw", "train"], results):
-                filename = "{model}-{algorithm}-{stage}-{workers}.pickle".format(
-                    model=model, algorithm=algorithm, stage=stage, workers=workers)
-                result.save(filename)
+    # Experiments whose results exist and are complete are skipped, so an interrupted run can simply be restarted.
+    manifest = Manifest("manifest-{}.json".format(workers))
+    todo = []
+    for model in args.models:
+        for algorithm in args.algorithms:
+            for stage in args.stages:
+                name = "{model}-{algorithm}-{stage}-{workers}{partitioned}".format(
+                    model=model, algorithm=algorithm, stage=stage, workers=workers,
+                    partitioned="-partitioned" if args.partition_plan else "")
+                cell = manifest.add(name, model=model, algorithm=algorithm, stage=stage, path=name + ".trace")
+                # A leftover store of a run with other settings is not counted as done.
+                config = dict(batch_size=batch_size[model], ps_tasks=args.ps_tasks, steps=args.repeat,
+                              warmup=args.warmup, trace_budget=args.trace_budget,
+                              trace_every=trace_interval(args.repeat, args.trace_every, args.trace_budget),
+                              partition_plan=load_plan(args.partition_plan, model) if args.partition_plan else {})
+                if is_complete(cell["path"], **config):
+                    cell["status"] = "done"
+                else:
+                    todo.append(name)
+    manifest.save()
+
+    master, cluster = resolve_master(args.master, workers, args.subprocesses, args.ps_tasks)
+    graph_cache = GraphCache(args.graph_cache)
+    for i, name in enumerate(todo):
+        cell = manifest.cells[name]
+        print("//{}\t({}/{}, ~{} left)".format(name, i + 1, len(todo), format_time(manifest.estimate(todo[i:]))))
+        for attempt in range(args.retries + 1):
+            try:
+                with Timer() as timer:
+                    run_cell(cell, master, batch_size[cell["model"]], graph_cache, args)
+                manifest.update(name, status="done", attempts=cell["attempts"] + 1, wall_time=timer.elapsed(),
+                                error=None)
+                break
+            except Exception as e:
+                manifest.update(name, status="failed", attempts=cell["attempts"] + 1, error=repr(e))
+                print("Failed: {!r}".format(e))
+                if attempt < args.retries:
+                    delay = args.backoff * 2 ** attempt
+                    print("Retrying in {:0.0f}s".format(delay))
+                    time.sleep(delay)
+    if cluster is not None:
+        cluster.stop()
+    print(graph_cache)
+    failed = [name for name in todo if manifest.cells[name]["status"] == "failed"]
+    if failed:
+        print("Failed: {}".format(", ".join(failed)))
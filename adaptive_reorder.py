@@ -0,0 +1,182 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import json
+import os
+import time
+
+from graph_ir import GraphIR
+from oracle import TimeOracle, parse_statistic
+from order_graphs import graph_oracle, oracle_filename, with_sends
+from priority_table import PriorityTable, graph_fingerprint
+from simulator import Simulator
+from trace_store import load_result
+from wizard import TAO
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class AdaptiveReorderer:
+    """
+    Keeps the TAO ordering of `graph` in line with the op durations observed while it runs. Sampled step traces are
+    merged into `oracle` and into a window of recent steps. Every `window` steps the window is compared with the
+    durations the current priorities were computed from; if they drifted by more than `threshold` (relative to the
+    total time of the ops), TAO is recomputed on the recent durations. The new ordering is adopted only if the
+    simulator predicts it to be more than `margin` faster. TAO is recomputed at most once per `min_interval` seconds,
+    whether its ordering was adopted or not.
+
+    Orderings and predictions see the oracle as `order_graphs.get_priorities` does (see `graph_oracle`), and the
+    saved table has the gradient sends after the reads. Only graphs exported for TAO are supported.
+    """
+
+    def __init__(self, graph, oracle, statistic="min", threshold=0.1, margin=0.02, window=20, min_interval=600,
+                 clock=time.time):
+        if graph.meta.get("algorithm") != "TAO":
+            raise ValueError("{}: adaptive re-ordering needs a TAO graph, not {}".format(
+                graph.meta.get("scope"), graph.meta.get("algorithm")))
+        self._graph = graph
+        self._scope = graph.meta.get("scope")
+        self.oracle = oracle
+        self._statistic = statistic
+        self._threshold = threshold
+        self._margin = margin
+        self._window_size = window
+        self._min_interval = min_interval
+        self._clock = clock
+        self._last_attempt = None
+        self.steps = 0
+        self.updates = 0
+        self.priorities = self._order(oracle)
+        self._rebase(oracle)
+
+    def _new_window(self):
+        self._window = TimeOracle(self._scope)
+        self._window_steps = 0
+
+    def _rebase(self, oracle):
+        self._reference = oracle.durations(self._statistic)
+        self._new_window()
+
+    def drift(self):
+        """Relative change of the window's op durations against the reference ones, weighted by duration."""
+        reference = total = 0
+        for op_name, duration in self._window.durations(self._statistic).items():
+            if self._reference.get(op_name):
+                reference += self._reference[op_name]
+                total += abs(duration - self._reference[op_name])
+        return total / reference if reference else 0
+
+    def _order(self, oracle):
+        return TAO(self._graph, graph_oracle(self._graph, oracle), self._statistic).get_priorities()
+
+    def _predict(self, oracle, priorities):
+        oracle = graph_oracle(self._graph, oracle)
+        return Simulator(self._graph, oracle, statistic=self._statistic).simulate(priorities).makespan
+
+    def observe(self, metadata):
+        """Adds one traced step; returns a decision dict when the ordering was reconsidered, else None."""
+        self.oracle.update(metadata)
+        self._window.update(metadata)
+        self.steps += 1
+        self._window_steps += 1
+        if self._window_steps < self._window_size:
+            return None
+
+        decision = dict(step=self.steps, drift=self.drift(), updated=False)
+        now = self._clock()
+        if decision["drift"] <= self._threshold:
+            self._new_window()
+            return decision
+        if self._last_attempt is not None and now - self._last_attempt < self._min_interval:
+            # Rate limited: the window keeps growing and is checked again after another `window` steps.
+            self._window_steps = 0
+            decision["rate_limited"] = True
+            return decision
+
+        self._last_attempt = now
+        recent = self.oracle.overlay(self._window)
+        priorities = self._order(recent)
+        current, candidate = self._predict(recent, self.priorities), self._predict(recent, priorities)
+        decision.update(current=current, candidate=candidate, gain=1 - candidate / current if current else 0)
+        if decision["gain"] > self._margin:
+            self.priorities = priorities
+            self.updates += 1
+            decision["updated"] = True
+        self._rebase(recent)
+        return decision
+
+    def save_table(self, filename):
+        """Replaces this graph's section of the priority table `filename` (other scopes are kept)."""
+        table = PriorityTable.load(filename) if os.path.exists(filename) else PriorityTable()
+        fingerprint = graph_fingerprint(self._graph)
+        new = PriorityTable.from_priorities({self._scope: with_sends(self._graph, self.priorities)},
+                                            {self._scope: fingerprint})
+        table.scopes[self._scope] = new.scopes[self._scope]
+        table.save(filename)
+
+
+def replay(filenames):
+    for filename in filenames:
+        for metadata in load_result(filename).metadata:
+            yield metadata
+
+
+def live(args, graph):
+    """Traces the model as exported in `graph` (batch size, workers, PS tasks and partitioning) on `args.master`."""
+    from exps import Experiment
+    experiment = Experiment(args.master, args.workers or graph.meta["workers"], graph.meta["model"],
+                            graph.meta["algorithm"], args.batch_size or graph.meta["batch_size"],
+                            ps_tasks=args.ps_tasks or graph.meta.get("ps_tasks", 1),
+                            partition_plan=graph.meta.get("partition_plan"))
+    for _, metadata in experiment.trace(args.stage, trace_every=args.trace_every):
+        yield metadata
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Re-orders a running model when its op durations drift.")
+    parser.add_argument("graph", help="Graph exported by 0_extract_orders.py e.g. graph-vgg16-TAO.json.gz")
+    parser.add_argument("-t", "--time-oracle", help="Initial time oracle (default: time-oracle-{model}.json)")
+    parser.add_argument("-o", "--output", help="Priority table to update", default="rpc_orders.bin")
+    parser.add_argument("--replay", help="Replay the traces of these results instead of running the model",
+                        nargs="+")
+    parser.add_argument("--master", help="Master uri of the cluster to trace")
+    parser.add_argument("--workers", help="Number of workers (default: the graph's)", type=int, default=None)
+    parser.add_argument("-b", "--batch-size", help="Batch size of the model (default: the graph's)", type=int,
+                        default=None)
+    parser.add_argument("-p", "--ps-tasks", help="Number of PS tasks (default: the graph's)", type=int, default=None)
+    parser.add_argument("--stage", help="Stage to trace", choices=["fw", "train"], default="train")
+    parser.add_argument("--trace-every", help="Trace one step out of this many", type=int, default=10)
+    parser.add_argument("-w", "--window", help="Traced steps per drift check", type=int, default=20)
+    parser.add_argument("--threshold", help="Relative drift of the op durations that triggers a re-ordering",
+                        type=float, default=0.1)
+    parser.add_argument("--margin", help="Minimum predicted speedup to adopt a new ordering", type=float,
+                        default=0.02)
+    parser.add_argument("--min-interval", help="Minimum seconds between two re-orderings, adopted or not", type=float,
+                        default=600)
+    parser.add_argument("-s", "--statistic", help="Op durations used by TAO: min, mean, max or a quantile e.g. 0.9",
+                        type=parse_statistic, default="min")
+    parser.add_argument("--log", help="Log of the decisions (JSON lines)", default="adaptive_reorder.jsonl")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    graph = GraphIR.load(args.graph)
+    oracle = TimeOracle.load(args.time_oracle or oracle_filename(graph.meta["model"]), graph.meta["scope"])
+    reorderer = AdaptiveReorderer(graph, oracle, args.statistic, args.threshold, args.margin, args.window,
+                                  args.min_interval)
+    reorderer.save_table(args.output)
+    traces = replay(args.replay) if args.replay else live(args, graph)
+    with open(args.log, "a") as log:
+        for metadata in traces:
+            decision = reorderer.observe(metadata)
+            if decision is None:
+                continue
+            log.write(json.dumps(decision) + "\n")
+            log.flush()
+            print("step {step}\tdrift: {drift:0.3f}\t{status}".format(
+                status="new ordering (predicted gain {:0.1%})".format(decision["gain"]) if decision["updated"] else
+                "gain {:0.1%} below margin".format(decision["gain"]) if "gain" in decision else
+                "rate limited" if decision.get("rate_limited") else "no drift", **decision))
+            if decision["updated"]:
+                reorderer.save_table(args.output)
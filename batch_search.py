@@ -0,0 +1,151 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import json
+import math
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from results import ResultAnalyser
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def step_a(run_metadata):
+    """Comm/comp ratio `a` of one traced step, as `ResultAnalyser.get_a` (midrange over the workers)."""
+    return float(ResultAnalyser(SimpleNamespace(metadata=[run_metadata])).get_a())
+
+
+def confidence_interval(samples, z=1.96):
+    """Mean of `samples` and its (normal approximation) confidence interval."""
+    mean = float(np.mean(samples)) if samples else math.nan
+    if len(samples) < 2:
+        return mean, -math.inf, math.inf
+    half = z * float(np.std(samples, ddof=1)) / math.sqrt(len(samples))
+    return mean, mean - half, mean + half
+
+
+class ProbeCache:
+    """Per-step `a` samples of every probed (model, workers, PS tasks, batch size), kept across invocations."""
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._samples = {}
+        if os.path.exists(filename):
+            with open(filename, "r") as fp:
+                self._samples = json.load(fp)
+
+    @staticmethod
+    def _key(model, workers, batch_size, ps_tasks):
+        return "{}-{}-{}-{}".format(model, workers, ps_tasks, batch_size)
+
+    def get(self, model, workers, batch_size, ps_tasks=1):
+        return list(self._samples.get(self._key(model, workers, batch_size, ps_tasks), []))
+
+    def add(self, model, workers, batch_size, samples, ps_tasks=1):
+        if not samples:
+            return
+        self._samples.setdefault(self._key(model, workers, batch_size, ps_tasks), []).extend(samples)
+        tmp = self._filename + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(self._samples, fp)
+        os.replace(tmp, self._filename)
+
+
+class BatchSizeSearch:
+    """
+    Finds a batch size with `low <= a <= high`. Comm time does not depend on the batch size and comp time grows
+    linearly with it, so 1/a is fitted as a line in the batch size and the next candidate is where it crosses 1,
+    kept inside the bracket of probed sizes that were too small (a > high) and too large (a < low); bisection is used
+    when the fit is unusable.
+
+    `probe(batch_size)` returns an iterator of per-step `a` samples. Each candidate is probed until the confidence
+    interval of its mean is inside, above or below the target (at least `min_steps`, at most `max_steps` steps).
+    """
+
+    def __init__(self, probe, model, workers, cache=None, low=0.9, high=1.1, min_size=1, max_step=100, min_steps=3,
+                 max_steps=10, attempts=10, ps_tasks=1):
+        self._probe = probe
+        self._model = model
+        self._workers = workers
+        self._ps_tasks = ps_tasks
+        self._cache = cache
+        self._low = low
+        self._high = high
+        self._min_size = min_size
+        self._max_step = max_step
+        self._min_steps = min_steps
+        self._max_steps = max(min_steps, max_steps)
+        self._attempts = attempts
+
+    def _decided(self, samples):
+        _, lower, upper = confidence_interval(samples)
+        if len(samples) < self._min_steps:
+            return False
+        return len(samples) >= self._max_steps or upper < self._low or lower > self._high or \
+            (lower >= self._low and upper <= self._high)
+
+    def measure(self, batch_size):
+        cached = self._cache.get(self._model, self._workers, batch_size, self._ps_tasks) if self._cache else []
+        samples = list(cached)
+        stream = None
+        try:
+            while not self._decided(samples):
+                if stream is None:
+                    stream = iter(self._probe(batch_size))
+                samples.append(next(stream))
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            if self._cache:
+                self._cache.add(self._model, self._workers, batch_size, samples[len(cached):], self._ps_tasks)
+        return confidence_interval(samples)[0], len(samples) - len(cached), len(cached)
+
+    def _fit(self, points):
+        if len(points) < 2:
+            return None
+        sizes = np.array(list(points), dtype=np.float64)
+        inverse_a = np.array([1 / a if a > 0 else math.inf for a in points.values()])
+        if not np.all(np.isfinite(inverse_a)) or len(np.unique(sizes)) < 2:
+            return None
+        slope, intercept = np.polyfit(sizes, inverse_a, 1)
+        if slope <= 0:
+            return None
+        return (1 - intercept) / slope
+
+    def _next(self, points, batch_size, a, too_small, too_large):
+        guess = self._fit(points)
+        if too_small is not None and too_large is not None:
+            if guess is None or not too_small < guess < too_large:
+                guess = math.sqrt(too_small * too_large)
+            return min(max(int(round(guess)), too_small + 1), too_large - 1)
+        if guess is None or (too_small is not None and guess <= too_small) or \
+                (too_large is not None and guess >= too_large):
+            guess = batch_size * min(self._max_step, a) if a > 0 else batch_size * self._max_step
+        guess = min(guess, batch_size * self._max_step)
+        return max(self._min_size, int(round(guess)))
+
+    def search(self, batch_size):
+        points = {}
+        too_small = too_large = None
+        for attempt in range(self._attempts):
+            a, probed, cached = self.measure(batch_size)
+            points[batch_size] = a
+            print("Attempt {}:\tbatch_size: {}\ta={:0.3f}\t(steps: {}, cached: {})".format(
+                attempt, batch_size, a, probed, cached))
+            if self._low <= a <= self._high:
+                return batch_size
+            if a > self._high:
+                too_small = batch_size if too_small is None else max(too_small, batch_size)
+            else:
+                too_large = batch_size if too_large is None else min(too_large, batch_size)
+            if too_small is not None and too_large is not None and too_large - too_small <= 1:
+                break
+            if too_large is not None and too_large <= self._min_size:
+                break
+            next_size = self._next(points, batch_size, a, too_small, too_large)
+            if next_size in points:
+                break
+            batch_size = next_size
+        return min(points, key=lambda size: abs(points[size] - 1))
@@ -0,0 +1,72 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import random
+
+import numpy as np
+
+from results import BatchEfficiency, device_groups
+from trace_store import DeviceStats, NodeStats, StepMetadata, StepStats, to_ops
+from utils import Efficiency, Timer
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def synthetic_trace(steps, workers, ops_per_worker, recv_ratio=0.3, seed=0, streams=0):
+    """
+    Random trace; with `streams`, the ops of a worker are spread over its GPU device, `stream:all` and `streams`
+    stream devices (whose names contain the GPU device's, as in TF GPU traces).
+    """
+    rnd = random.Random(seed)
+    metadata = []
+    for step in range(steps):
+        dev_stats = []
+        for worker in range(workers):
+            now = 1500000000000000 + step * 10 ** 7
+            device = "/job:worker/replica:0/task:{}/device:{}:0".format(worker, "GPU" if streams else "CPU")
+            names = [device] + ["{}/stream:{}".format(device, stream)
+                                for stream in (["all"] + list(range(streams)) if streams else [])]
+            node_stats = {name: [] for name in names}
+            for i in range(ops_per_worker):
+                now += rnd.randint(0, 50)
+                duration = rnd.randint(0, 400)
+                if rnd.random() < recv_ratio:
+                    op = NodeStats("RecvTensor", now, duration, duration,
+                                   "edge_{}_w{}/read from /job:ps/task:0".format(i, i))
+                else:
+                    op = NodeStats("op{}".format(i), now, duration, duration, "")
+                node_stats[rnd.choice(names)].append(op)
+            dev_stats += [DeviceStats(name, stats) for name, stats in node_stats.items()]
+        dev_stats.append(DeviceStats("/job:ps/replica:0/task:0/device:CPU:0", []))
+        metadata.append(StepMetadata(StepStats(dev_stats)))
+    return metadata
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compares the per-op Efficiency loop with BatchEfficiency.")
+    parser.add_argument("-s", "--steps", help="Number of steps", type=int, default=100)
+    parser.add_argument("-w", "--workers", help="Number of workers", type=int, default=32)
+    parser.add_argument("-o", "--ops", help="Ops per worker per step", type=int, default=1000)
+    parser.add_argument("--streams", help="GPU streams per worker, whose devices overlap the worker's GPU device "
+                                          "(0: one CPU device per worker)", type=int, default=2)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    metadata = synthetic_trace(args.steps, args.workers, args.ops, streams=args.streams)
+
+    with Timer() as convert:
+        ops, _, devices, _ = to_ops(metadata)
+    workers = [name for name in devices if "worker" in name]
+    with Timer() as batch_timer:
+        batch = BatchEfficiency(device_groups(ops, devices, workers), len(workers))
+    with Timer() as loop_timer:
+        effs = [[Efficiency(m, device_search=device) for device in workers] for m in metadata]
+
+    for field in ("M", "P", "U", "E", "S", "a"):
+        expected = np.array([[getattr(e, field) for e in row] for row in effs], dtype=np.float64)
+        assert np.allclose(getattr(batch, field), expected), field
+    print("steps: {} workers: {} streams: {} ops: {}".format(args.steps, args.workers, args.streams, len(ops)))
+    print("per-op loop: {:0.3f}s\tbatched: {:0.3f}s (+{:0.3f}s to build columns)\tspeedup: {:0.1f}x".format(
+        loop_timer.elapsed(), batch_timer.elapsed(), convert.elapsed(), loop_timer.elapsed() / batch_timer.elapsed()))
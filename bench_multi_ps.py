@@ -0,0 +1,70 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import random
+
+from graph_ir import GraphIR
+from simulator import Simulator
+from synthetic_graphs import RandomOracle
+from wizard import TAO, TIO
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def random_graph(variables, ops, ps_tasks, seed=0, max_inputs=3):
+    """Random DAG whose `variables` reads are sharded round-robin over `ps_tasks` PS tasks."""
+    rnd = random.Random(seed)
+    names, inputs, recv, devices = [], [], [], []
+
+    def add(name, node_inputs, is_recv=False, device=""):
+        names.append(name + ":0")
+        inputs.append(tuple(node_inputs))
+        recv.append(is_recv)
+        devices.append(device)
+        return len(names) - 1
+
+    nodes = [add("v{}/read".format(v), (), True, "/job:ps/task:{}".format(v % ps_tasks)) for v in range(variables)]
+    comps = []
+    for i in range(ops):
+        comps.append(add("op{}".format(i), rnd.sample(nodes, min(rnd.randint(1, max_inputs), len(nodes)))))
+        nodes.append(comps[-1])
+    consumed = {i for node_inputs in inputs for i in node_inputs}
+    target = add("target", [node for node in nodes if node not in consumed])
+    return GraphIR(names, inputs, recv, target, devices=devices)
+
+
+def single_channel(graph):
+    return GraphIR(graph.names, graph.inputs, graph.recv, graph.target, graph.meta, graph.sizes)
+
+
+def run(ps_tasks, seed, variables, ops, comm_time):
+    graph = random_graph(variables, ops, ps_tasks, seed)
+    oracle = RandomOracle(seed, comm=(1, comm_time))
+    simulator = Simulator(graph, oracle)
+    return dict(ps=ps_tasks, seed=seed,
+                none=simulator.simulate(None).makespan,
+                TIO=simulator.simulate(TIO(graph).get_priorities()).makespan,
+                TAO_single=simulator.simulate(TAO(single_channel(graph), oracle).get_priorities()).makespan,
+                TAO=simulator.simulate(TAO(graph, oracle).get_priorities()).makespan)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compares per-channel TAO with the single-channel TAO ordering on "
+                                                 "simulated multi-PS setups.")
+    parser.add_argument("-p", "--ps-tasks", help="Numbers of PS tasks", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("-g", "--graphs", help="Random graphs per setup", type=int, default=10)
+    parser.add_argument("-v", "--variables", help="Variables per graph", type=int, default=64)
+    parser.add_argument("-o", "--ops", help="Comp ops per graph", type=int, default=400)
+    parser.add_argument("-c", "--comm-time", help="Maximum transfer time of a variable (comp ops take up to 100)",
+                        type=int, default=1500)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print("ps\tnone\tTIO\tTAO(single channel)\tTAO(per channel)\tspeedup")
+    for ps_tasks in args.ps_tasks:
+        rows = [run(ps_tasks, seed, args.variables, args.ops, args.comm_time) for seed in range(args.graphs)]
+        mean = {key: sum(row[key] for row in rows) / len(rows) for key in ("none", "TIO", "TAO_single", "TAO")}
+        print("{}\t{:0.0f}\t{:0.0f}\t{:0.0f}\t{:0.0f}\t{:0.3f}".format(
+            ps_tasks, mean["none"], mean["TIO"], mean["TAO_single"], mean["TAO"], mean["TAO_single"] / mean["TAO"]))
@@ -0,0 +1,156 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import sys
+import tracemalloc
+
+import utils
+from simulator import Simulator
+from synthetic_graphs import RandomOracle, layered_graph, transformer_graph
+from utils import Timer
+from wizard import TAO
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class MissingOracle:
+    """Every op takes `TAO.MISSING_TIME`, as if none were in the oracle, so that most comparisons tie."""
+
+    def query(self, name, statistic="min"):
+        return TAO.MISSING_TIME
+
+
+class ReferenceTAO(TAO):
+    """The original sort-per-pick TAO loop, kept as the reference for the incremental engine."""
+
+    def _comparator(self, op1, op2):
+        a = min(self._P[op2], self._M[op1])
+        b = min(self._P[op1], self._M[op2])
+
+        if a != b:
+            return a < b
+        else:
+            return self._Mp[op1] < self._Mp[op2]
+
+    def get_priorities(self):
+        outstanding_comm_ops = list(range(len(self._comm_ops)))
+        priorities = []
+        counter = 0
+        while outstanding_comm_ops:
+            self._update_properties(sum(1 << op for op in outstanding_comm_ops))
+            outstanding_comm_ops.sort(key=utils.cmp_to_key(self._comparator))
+            priorities.append((counter, self._graph.op_name(self._comm_ops[outstanding_comm_ops[0]])))
+            counter += 1
+            del outstanding_comm_ops[0]
+        return priorities
+
+    def beaten_picks(self, priorities):
+        """Number of picks of `priorities` that another outstanding recv op beats under the comparator."""
+        index = {self._graph.op_name(op): r for r, op in enumerate(self._comm_ops)}
+        outstanding = set(range(len(self._comm_ops)))
+        beaten = 0
+        for _, name in priorities:
+            r = index[name]
+            self._update_properties(sum(1 << op for op in outstanding))
+            beaten += any(self._comparator(op, r) for op in outstanding if op != r)
+            outstanding.discard(r)
+        return beaten
+
+
+def build_graph(layout):
+    # TF is only needed for the ToyModel graphs, not for the tie check.
+    import tensorflow as tf
+    from models import ToyModel
+    tf.reset_default_graph()
+    model, _ = ToyModel(4 * 1000, layout, scope="bench")()
+    return model
+
+
+def timed(ordering, target, oracle):
+    tracemalloc.start()
+    with Timer() as timer:
+        priorities = ordering(target, oracle).get_priorities()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return priorities, timer.elapsed(), peak
+
+
+def run(layout, oracle, reference_limit):
+    with Timer() as timer:
+        target = build_graph(layout)
+    build_time = timer.elapsed()
+    priorities, tao_time, tao_memory = timed(TAO, target, oracle)
+    row = dict(params=sum(layout), layers=len(layout), build=build_time, tao=tao_time, tao_memory=tao_memory,
+               reference=None, reference_memory=None, match=None)
+    if row["params"] <= reference_limit:
+        reference, row["reference"], row["reference_memory"] = timed(ReferenceTAO, target, oracle)
+        row["match"] = [op for _, op in priorities] == [op for _, op in reference]
+    return row
+
+
+def tie_check(seeds):
+    """
+    TAO against the reference on small synthetic graphs with tie-heavy durations. The comparator is not transitive on
+    ties, so the reference's pick depends on how the sort visits the ops and can be beaten by another op; rows count
+    the orderings that match, the recv ops whose priority differs, the picks beaten under the comparator and the
+    simulated iteration time of TAO's ordering relative to the reference's.
+    """
+    oracles = [("1..2", lambda seed: RandomOracle(seed, (1, 2))), ("1..5", lambda seed: RandomOracle(seed, (1, 5))),
+               ("1..10000", lambda seed: RandomOracle(seed, (1, 10000))), ("missing", lambda seed: MissingOracle())]
+    for name, oracle_factory in oracles:
+        row = dict(oracle=name, runs=0, match=0, ops=0, moved=0, tao_beaten=0, reference_beaten=0, makespan=0,
+                   reference_makespan=0)
+        for seed in seeds:
+            for graph in (layered_graph(60, 6, seed=seed), layered_graph(40, 3, 3, 0.2, seed=seed),
+                          transformer_graph(2, seed=seed)):
+                oracle = oracle_factory(seed)
+                priorities = TAO(graph, oracle).get_priorities()
+                reference = ReferenceTAO(graph, oracle)
+                reference_priorities = reference.get_priorities()
+                row["runs"] += 1
+                row["match"] += [op for _, op in priorities] == [op for _, op in reference_priorities]
+                row["ops"] += len(priorities)
+                row["moved"] += len(set(priorities) - set(reference_priorities))
+                row["tao_beaten"] += reference.beaten_picks(priorities)
+                row["reference_beaten"] += reference.beaten_picks(reference_priorities)
+                simulator = Simulator(graph, oracle)
+                row["makespan"] += simulator.simulate(priorities).makespan
+                row["reference_makespan"] += simulator.simulate(reference_priorities).makespan
+        yield row
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--params", help="Parameter counts to benchmark", type=int, nargs="+",
+                        default=[250, 500, 1000, 2000, 4000, 8000, 16000])
+    parser.add_argument("-l", "--layers", help="Layers per graph (parameters are split evenly)", type=int,
+                        nargs="+", default=[1, 8])
+    parser.add_argument("-r", "--reference-limit", help="Largest graph to also run the reference TAO on", type=int,
+                        default=1000)
+    parser.add_argument("-s", "--seed", help="Seed of the random time oracle", type=int, default=0)
+    parser.add_argument("--ties", help="Only compare with the reference on tie-heavy synthetic graphs, over this "
+                                       "many seeds", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.ties:
+        print("oracle\truns\tmatch\tmoved ops\tTAO beaten picks\treference beaten picks\tTAO/reference makespan")
+        for row in tie_check(range(args.seed, args.seed + args.ties)):
+            print("{oracle}\t{runs}\t{match}\t{moved:0.1%}\t{tao_beaten}\t{reference_beaten}\t{ratio:0.4f}".format(
+                moved=row.pop("moved") / row["ops"], ratio=row["makespan"] / row["reference_makespan"], **row))
+        sys.exit(0)
+    oracle = RandomOracle(args.seed, (1, 10000))
+    print("params\tlayers\tbuild(s)\tTAO(s)\tTAO(MB)\treference(s)\treference(MB)\tmatch")
+    for layers in args.layers:
+        for params in args.params:
+            layout = [max(1, params // layers) for _ in range(layers)]
+            row = run(layout, oracle, args.reference_limit)
+            if row["reference"] is None:
+                row.update(reference="-", reference_memory="-", match="-")
+            else:
+                row.update(reference="{:0.3f}".format(row["reference"]),
+                           reference_memory="{:0.1f}".format(row["reference_memory"] / 2 ** 20))
+            print("{params}\t{layers}\t{build:0.2f}\t{tao:0.3f}\t{tao_memory_mb:0.1f}\t{reference}\t"
+                  "{reference_memory}\t{match}".format(tao_memory_mb=row["tao_memory"] / 2 ** 20, **row))
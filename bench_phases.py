@@ -0,0 +1,148 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import json
+import platform
+import tracemalloc
+
+from synthetic_graphs import GENERATORS, SIZE_DISTRIBUTIONS, RandomOracle, layered_graph, transformer_graph
+from utils import Timer
+from wizard import TAO, TIO
+
+__author__ = 'Sayed Hadi Hashemi'
+
+# Methods of the orderings timed separately, plus the TAO engine's picks ("schedule"); whatever else
+# `get_priorities` does is counted as "order".
+PHASES = dict(_seperate_comp_comm="separate", _find_comm_dependencies="dependencies", _query_times="oracle",
+              _update_properties="properties", _get_engine="engine")
+ORDERINGS = dict(TAO=TAO, TIO=TIO)
+TRANSFORMER_BLOCK_PARAMS = 16
+
+
+def add_time(ordering, phase, elapsed):
+    times = ordering.__dict__.setdefault("phase_times", {})
+    times[phase] = times.get(phase, 0) + elapsed
+
+
+def profiled(ordering_class):
+    """
+    Subclass of `ordering_class` that adds the time spent in each of `PHASES` to `self.phase_times`. The picks of the
+    TAO engine (`order()`, a generator consumed by `get_priorities`) are run up front and timed as "schedule".
+    """
+    def timed(method, phase):
+        def wrapper(self, *args, **kwargs):
+            with Timer() as timer:
+                result = method(self, *args, **kwargs)
+            add_time(self, phase, timer.elapsed())
+            return result
+        return wrapper
+
+    def timed_engine(method):
+        def wrapper(self, *args, **kwargs):
+            engine = method(self, *args, **kwargs)
+            order = engine.order
+
+            def timed_order():
+                with Timer() as timer:
+                    picks = list(order())
+                add_time(self, "schedule", timer.elapsed())
+                return iter(picks)
+            engine.order = timed_order
+            return engine
+        return wrapper
+
+    methods = {name: timed(getattr(ordering_class, name), phase) for name, phase in PHASES.items()
+               if hasattr(ordering_class, name)}
+    if "_get_engine" in methods:
+        methods["_get_engine"] = timed_engine(methods["_get_engine"])
+    return type("Profiled" + ordering_class.__name__, (ordering_class,), methods)
+
+
+def make_graph(generator, recv_ops, depth, fan_in, shared, sizes, seed):
+    if generator == "transformer":
+        return transformer_graph(max(1, recv_ops // TRANSFORMER_BLOCK_PARAMS), seed=seed)
+    return layered_graph(recv_ops, depth, fan_in, shared, seed=seed, size_distribution=sizes)
+
+
+def run_ordering(name, graph, oracle):
+    ordering_class = profiled(ORDERINGS[name])
+    args = (graph, oracle) if name == "TAO" else (graph,)
+    with Timer() as construct_timer:
+        ordering = ordering_class(*args)
+    with Timer() as priorities_timer:
+        priorities = ordering.get_priorities()
+    phases = dict(ordering.phase_times)
+    ordered = sum(time for phase, time in phases.items() if phase in ("properties", "engine", "schedule"))
+    phases["order"] = priorities_timer.elapsed() - ordered
+    phases["total"] = construct_timer.elapsed() + priorities_timer.elapsed()
+    return phases, priorities
+
+
+def peak_memory(name, graph, oracle):
+    tracemalloc.start()
+    ORDERINGS[name](*((graph, oracle) if name == "TAO" else (graph,))).get_priorities()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark(generator, recv_ops, algorithms, depth, fan_in, shared, sizes, seed, memory):
+    with Timer() as timer:
+        graph = make_graph(generator, recv_ops, depth, fan_in, shared, sizes, seed)
+    oracle = RandomOracle(seed)
+    for name in algorithms:
+        phases, priorities = run_ordering(name, graph, oracle)
+        yield dict(generator=generator, algorithm=name, recv_ops=sum(graph.recv), nodes=len(graph),
+                   build=timer.elapsed(), phases=phases, ordered=len(priorities),
+                   peak_memory=peak_memory(name, graph, oracle) if memory else None)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Times the phases of TAO/TIO on synthetic graphs.")
+    parser.add_argument("-n", "--recv-ops", help="Numbers of recv ops (parameters)", type=int, nargs="+",
+                        default=[100, 1000, 10000, 100000])
+    parser.add_argument("-g", "--generators", help="Graph generators", nargs="+", choices=sorted(GENERATORS),
+                        default=sorted(GENERATORS))
+    parser.add_argument("-a", "--algorithms", help="Orderings", nargs="+", choices=sorted(ORDERINGS),
+                        default=["TAO", "TIO"])
+    parser.add_argument("-d", "--depth", help="Layers of the layered graphs", type=int, default=32)
+    parser.add_argument("-f", "--fan-in", help="Inputs from the previous layer per op", type=int, default=2)
+    parser.add_argument("--shared", help="Probability an op reuses an earlier parameter", type=float, default=0.05)
+    parser.add_argument("--sizes", help="Parameter size distribution", choices=sorted(SIZE_DISTRIBUTIONS),
+                        default="lognormal")
+    parser.add_argument("-m", "--max-seconds", help="Skip the larger graphs of an ordering once it took longer than "
+                                                     "this", type=float, default=300)
+    parser.add_argument("--no-memory", help="Skip the (slower) peak memory runs", action="store_true")
+    parser.add_argument("-o", "--output", help="JSON results", default="bench_phases.json")
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rows = []
+    skipped = []
+    print("generator\talgorithm\trecv ops\tnodes\tseparate(s)\tdependencies(s)\toracle(s)\tproperties(s)\t"
+          "engine(s)\tschedule(s)\torder(s)\ttotal(s)\tpeak(MB)")
+    recv_ops_list = sorted(args.recv_ops)
+    for generator in args.generators:
+        algorithms = list(args.algorithms)
+        for recv_ops in recv_ops_list:
+            for row in benchmark(generator, recv_ops, tuple(algorithms), args.depth, args.fan_in, args.shared,
+                                 args.sizes, args.seed, not args.no_memory):
+                rows.append(row)
+                phases = row["phases"]
+                print("{}\t{}\t{}\t{}\t{}\t{}".format(
+                    row["generator"], row["algorithm"], row["recv_ops"], row["nodes"],
+                    "\t".join("{:0.3f}".format(phases[phase]) if phase in phases else "-"
+                              for phase in ("separate", "dependencies", "oracle", "properties", "engine", "schedule",
+                                            "order", "total")),
+                    "-" if row["peak_memory"] is None else "{:0.1f}".format(row["peak_memory"] / 2 ** 20)))
+                larger = [n for n in recv_ops_list if n > recv_ops]
+                if phases["total"] > args.max_seconds and larger:
+                    algorithms.remove(row["algorithm"])
+                    skipped.append(dict(generator=generator, algorithm=row["algorithm"], recv_ops=larger))
+                # Written after every row, so that a long run can be inspected (or killed) early.
+                with open(args.output, "w") as fp:
+                    json.dump(dict(python=platform.python_version(), seed=args.seed, max_seconds=args.max_seconds,
+                                   results=rows, skipped=skipped), fp, indent=1)
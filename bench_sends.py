@@ -0,0 +1,119 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+
+from bench_multi_ps import random_graph
+from simulator import Simulator
+from synthetic_graphs import RandomOracle
+from wizard import TAO, send_priorities
+
+__author__ = 'Sayed Hadi Hashemi'
+
+SEND_ORDERS = ("fifo", "priority")
+
+
+class TrainSimulator(Simulator):
+    """
+    Consecutive train iterations of a worker. The forward pass is simulated as by `Simulator`, except that the read
+    of a variable can not start before the send of its gradient in the previous iteration has reached the PS. The
+    backward pass runs the comp ops in reverse order (`backward` times their forward duration each); a gradient is
+    ready once the backward ops of all the consumers of its variable are done. Gradients are pushed on a per-PS link
+    of their own, one at a time and as soon as they are ready, either in the order they became ready ("fifo") or by
+    `send_priorities` among the ready ones ("priority").
+    """
+
+    def __init__(self, graph, time_oracle, link=None, statistic="min", backward=1.0):
+        super().__init__(graph, time_oracle, link, statistic)
+        self._backward = backward
+        self._variables = [self._graph.recv_name(op) for op in self._comm_ops]
+
+    def _send_ranks(self, priorities):
+        sends = [(variable + "/gradient", variable) for variable in self._variables]
+        return [counter for counter, _ in send_priorities(sends, priorities)]
+
+    def _gradients_ready(self, start, comp_end):
+        """Backward pass starting at `start`; returns its end and the time each gradient is ready."""
+        now = start
+        ready = [start] * len(self._comm_ops)
+        for o in sorted(range(len(self._op_names)), key=lambda op: -comp_end[op]):
+            now += self._op_times[o] * self._backward
+            for r in self._op_recvs[o]:
+                ready[r] = max(ready[r], now)
+        return now, ready
+
+    def _send(self, ready, ranks, link_free, send_order):
+        end = [0] * len(ready)
+        for channel in set(self._channels):
+            pending = [r for r in range(len(ready)) if self._channels[r] == channel]
+            now = link_free.get(channel, 0)
+            while pending:
+                available = [r for r in pending if ready[r] <= now]
+                if not available:
+                    now = min(ready[r] for r in pending)
+                    continue
+                r = min(available, key=lambda s: (ranks[s], s) if send_order == "priority" else (ready[s], s))
+                pending.remove(r)
+                now = end[r] = now + self._recv_times[r]
+            link_free[channel] = now
+        return end
+
+    def train(self, priorities, send_order="priority", iterations=10):
+        """Durations of `iterations` train iterations with the reads ordered by `priorities`."""
+        order = self._comm_order(priorities)
+        ranks = self._send_ranks(priorities)
+        sent = [0] * len(self._comm_ops)
+        link_free = {}
+        start = 0
+        durations = []
+        for _ in range(iterations):
+            pull_free = {}
+            recv_end = [0] * len(self._comm_ops)
+            for r in order:
+                channel = self._channels[r]
+                begin = max(pull_free.get(channel, start), sent[r])
+                pull_free[channel] = end = begin + self._recv_times[r]
+                recv_end[r] = end - start
+            _, comp_end = self._simulate_comp(recv_end)
+            forward_end = start + max(recv_end + comp_end, default=0)
+            backward_end, ready = self._gradients_ready(forward_end, [start + end for end in comp_end])
+            sent = self._send(ready, ranks, link_free, send_order)
+            durations.append(backward_end - start)
+            start = backward_end
+        return durations
+
+
+def run(ps_tasks, seed, variables, ops, comm_time, iterations):
+    graph = random_graph(variables, ops, ps_tasks, seed)
+    oracle = RandomOracle(seed, comm=(1, comm_time))
+    simulator = TrainSimulator(graph, oracle)
+    priorities = TAO(graph, oracle).get_priorities()
+    row = dict(ps=ps_tasks, seed=seed)
+    for send_order in SEND_ORDERS:
+        # The first iterations do not wait for any send; the steady state is the second half.
+        durations = simulator.train(priorities, send_order, iterations)[iterations // 2:]
+        row[send_order] = sum(durations) / len(durations)
+    return row
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compares the train throughput with gradient sends in arrival "
+                                                 "order and in send_priorities order, in simulation.")
+    parser.add_argument("-p", "--ps-tasks", help="Numbers of PS tasks", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("-g", "--graphs", help="Random graphs per setup", type=int, default=10)
+    parser.add_argument("-v", "--variables", help="Variables per graph", type=int, default=64)
+    parser.add_argument("-o", "--ops", help="Comp ops per graph", type=int, default=400)
+    parser.add_argument("-c", "--comm-time", help="Maximum transfer time of a variable (comp ops take up to 100)",
+                        type=int, default=1500)
+    parser.add_argument("-i", "--iterations", help="Train iterations simulated per graph", type=int, default=10)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print("ps\tfifo(iter/s)\tpriority(iter/s)\tspeedup")
+    for ps_tasks in args.ps_tasks:
+        rows = [run(ps_tasks, seed, args.variables, args.ops, args.comm_time, args.iterations)
+                for seed in range(args.graphs)]
+        mean = {key: sum(row[key] for row in rows) / len(rows) for key in SEND_ORDERS}
+        print("{}\t{:0.1f}\t{:0.1f}\t{:0.3f}".format(ps_tasks, 1e6 / mean["fifo"], 1e6 / mean["priority"],
+                                                     mean["fifo"] / mean["priority"]))
@@ -0,0 +1,124 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import gzip
+import json
+import re
+
+from oracle import TimeOracle, serialized_transfers
+from trace_store import load_result
+
+__author__ = 'Sayed Hadi Hashemi'
+
+STEPS_LANE = 0
+COMP_LANE = 1
+
+
+def load_header_priorities(filename):
+    """{name: priority} of an `rpc_orders.h` written by `priority_print`."""
+    with open(filename, "r") as fp:
+        return {name: int(priority) for name, priority in re.findall('{"(.+?)", (-?\\d+)}', fp.read())}
+
+
+def transfer_name(op):
+    tensor = re.findall("edge_\\d+_(.+?) from ", op.timeline_label)
+    return tensor[0] if tensor else op.timeline_label
+
+
+class ChromeTraceWriter:
+    """
+    Streams steps as Chrome trace events (chrome://tracing, ui.perfetto.dev). Each worker is a process with a lane of
+    steps, a lane of comp ops and one lane of RecvTensor transfers per source PS. Transfers start where
+    `TimeOracle.update` attributes them (after the previous transfer of their channel) and carry their priority.
+    """
+
+    def __init__(self, fp, priorities=None):
+        self._fp = fp
+        self._priorities = priorities or {}
+        self._pids = {}
+        self._tids = {}
+        self._origin = None
+        self._first = True
+        self._fp.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+
+    def _event(self, **event):
+        if not self._first:
+            self._fp.write(",\n")
+        self._first = False
+        self._fp.write(json.dumps(event, separators=(",", ":")))
+
+    def _pid(self, device):
+        if device not in self._pids:
+            self._pids[device] = len(self._pids)
+            self._event(ph="M", name="process_name", pid=self._pids[device], args=dict(name=device))
+            for tid, name in ((STEPS_LANE, "steps"), (COMP_LANE, "comp")):
+                self._event(ph="M", name="thread_name", pid=self._pids[device], tid=tid, args=dict(name=name))
+        return self._pids[device]
+
+    def _tid(self, pid, source):
+        if (pid, source) not in self._tids:
+            self._tids[pid, source] = COMP_LANE + 1 + sum(1 for p, _ in self._tids if p == pid)
+            self._event(ph="M", name="thread_name", pid=pid, tid=self._tids[pid, source],
+                        args=dict(name="recv from {}".format(source)))
+        return self._tids[pid, source]
+
+    def _priority(self, name):
+        return self._priorities.get(name[:-5] if name.endswith("/read") else name)
+
+    def add_step(self, step, metadata):
+        workers = [d for d in metadata.step_stats.dev_stats if "worker" in d.device]
+        if self._origin is None:
+            self._origin = min((op.all_start_micros for d in workers for op in d.node_stats), default=0)
+        recv_ops = []
+        for device in workers:
+            pid = self._pid(device.device)
+            start = end = None
+            for op in device.node_stats:
+                op_end = op.all_start_micros + op.all_end_rel_micros
+                start = op.all_start_micros if start is None else min(start, op.all_start_micros)
+                end = op_end if end is None else max(end, op_end)
+                if op.node_name == "RecvTensor":
+                    recv_ops.append((device.device, op))
+                else:
+                    self._event(ph="X", name=op.node_name, cat="comp", pid=pid, tid=COMP_LANE,
+                                ts=op.all_start_micros - self._origin, dur=op.all_end_rel_micros, args=dict(step=step))
+            if start is not None:
+                self._event(ph="X", name="step {}".format(step), cat="step", pid=pid, tid=STEPS_LANE,
+                            ts=start - self._origin, dur=end - start)
+
+        for device, op, op_start, op_end in serialized_transfers(recv_ops):
+            pid = self._pid(device)
+            name = transfer_name(op)
+            args = dict(step=step, priority=self._priority(name), requested=op.all_start_micros - self._origin)
+            self._event(ph="X", name=name, cat="comm", pid=pid, tid=self._tid(pid, TimeOracle.recv_source(op)),
+                        ts=op_start - self._origin, dur=op_end - op_start, args=args)
+
+    def close(self):
+        self._fp.write("\n]}\n")
+
+
+def export(result, filename, priorities=None, steps=None):
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "wt") as fp:
+        writer = ChromeTraceWriter(fp, priorities)
+        traced_steps = getattr(result, "traced_steps", None)
+        for i, metadata in enumerate(result.metadata):
+            if steps is not None and i >= steps:
+                break
+            writer.add_step(traced_steps[i] if traced_steps else i, metadata)
+        writer.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Exports experiment results as Chrome/Perfetto traces.")
+    parser.add_argument("result", help="Result of 1_run_experiments.py e.g. vgg16-TAO-fw-4.trace")
+    parser.add_argument("-o", "--output", help="Trace file (.json or .json.gz)", default="trace.json.gz")
+    parser.add_argument("-p", "--priorities", help="rpc_orders.h whose priorities are shown on the transfers")
+    parser.add_argument("-n", "--steps", help="Export only the first N steps", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    priorities = load_header_priorities(args.priorities) if args.priorities else None
+    export(load_result(args.result), args.output, priorities, args.steps)
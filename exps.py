@@ -1,39 +1,81 @@
 #! /usr/bin/env python -u
 # coding=utf-8
 import tensorflow as tf
+import json
 import pickle
+import zlib
 from models import get_base_graph
 
 from oracle import TimeOracle
+from trace_store import TraceStore, untraced_times
 from utils import Timer, Timeline, log_progress
 
 __author__ = 'Sayed Hadi Hashemi'
 
+LOSS_COLLECTION = "experiment_loss"
+TRAIN_COLLECTION = "experiment_train"
+
+
+def trace_interval(steps, trace_every=None, trace_budget=None):
+    """Steps between traced steps: `trace_every`, or by default every step or `trace_budget` spread over the run."""
+    if trace_every is None:
+        return max(1, steps // trace_budget) if trace_budget else 1
+    return trace_every
+
+
+def build_replicas(model, batch_size, workers, ps_tasks, scope, partition_plan=None):
+    """
+    Builds the replicas of `model` the `workers` workers run, in the default graph: variables are shared and placed by
+    `replica_device_setter`. Returns the losses and train ops of the replicas.
+    """
+    losses = []
+    trains = []
+    for w in range(workers):
+        with tf.variable_scope("", reuse=w > 0):
+            setter = tf.train.replica_device_setter(worker_device="/job:worker/task:{}".format(w), ps_tasks=ps_tasks)
+            with tf.device(setter):
+                loss_ = get_base_graph(model, batch_size, scope, partition_plan)
+                opt = tf.train.GradientDescentOptimizer(learning_rate=0.001)
+                losses.append(loss_)
+                trains.append(opt.minimize(loss_))
+    return losses, trains
+
 
 class ExperimentResult:
     def __init__(self, **kwargs):
         self.times = []
         self.metadata = []
+        self.traced_steps = []
         self.__dict__.update(kwargs)
 
+    def untraced_times(self):
+        return untraced_times(self)
+
     def save(self, filename):
         with open(filename, "wb") as fp:
             pickle.dump(self, fp)
 
+    def save_trace(self, path):
+        TraceStore.write(self, path)
+
     def save_time_oracle(self, filename):
         oracle = TimeOracle()
-        for m in self.metadata:
-            oracle.update(m)
+        oracle.update_many(self.metadata)
         oracle.save(filename)
 
 
 class Experiment:
-    def __init__(self, master, workers, base_model, ordering_algorithm, batch_size):
+    def __init__(self, master, workers, base_model, ordering_algorithm, batch_size, graph_cache=None, ps_tasks=1,
+                 partition_plan=None):
+        """`partition_plan` ({variable name: chunks}) partitions these variables of the model."""
         self._master = master
         self._workers = workers
         self._model = base_model
         self._batch_size = batch_size
         self._ordering_algorithm = ordering_algorithm
+        self._graph_cache = graph_cache
+        self._ps_tasks = ps_tasks
+        self._partition_plan = partition_plan or {}
         self._train = []
         self._loss = []
         self.get_model()
@@ -42,40 +84,71 @@ class Experiment:
         return "{}-{}".format(self._model, self._ordering_algorithm)
 
     def get_model(self):
+        if self._graph_cache is None:
+            self._build_model()
+        else:
+            key = (self._model, self._batch_size, self._workers, self._ps_tasks, self._get_scope())
+            if self._partition_plan:
+                # Part of the cache file names, hence hashed.
+                plan = json.dumps(self._partition_plan, sort_keys=True).encode()
+                key += ("partitioned_{:08x}".format(zlib.crc32(plan)),)
+            self._graph_cache.get(key, self._build_model)
+        self._loss = tf.get_collection(LOSS_COLLECTION)
+        self._train = tf.get_collection(TRAIN_COLLECTION)
+
+    def _build_model(self):
         tf.reset_default_graph()
-        worker_devices = [
-            "/job:worker/task:{worker}".format(worker=w)
-            for w in range(self._workers)
-        ]
-        self._train = []
-        self._loss = []
-        scope = self._get_scope()
-        first = True
-        for worker_device in worker_devices:
-            with tf.variable_scope("", reuse=not first):
-                first = False
-                with tf.device(tf.train.replica_device_setter(worker_device=worker_device, ps_tasks=1)):
-                    loss_ = get_base_graph(self._model, self._batch_size, scope)
-                    self._loss.append(loss_)
-                    opt = tf.train.GradientDescentOptimizer(learning_rate=0.001)
-                    train_ = opt.minimize(loss_)
-                    self._train.append(train_)
-
-    def run(self, steps, stages=("fw", "train")):
+        losses, trains = build_replicas(self._model, self._batch_size, self._workers, self._ps_tasks,
+                                        self._get_scope(), self._partition_plan)
+        for loss_, train_ in zip(losses, trains):
+            tf.add_to_collection(LOSS_COLLECTION, loss_)
+            tf.add_to_collection(TRAIN_COLLECTION, train_)
+
+    def trace(self, stage="fw", warmup=1, trace_every=1):
+        """
+        Runs `stage` in one session until closed, yielding the time and RunMetadata of every `trace_every`-th step
+        (the steps in between run without tracing).
+        """
+        target = self._loss if stage == "fw" else self._train
+        with tf.train.MonitoredTrainingSession(master=self._master) as sess:
+            for _ in range(warmup):
+                sess.run(target)
+            while True:
+                for _ in range(trace_every - 1):
+                    sess.run(target)
+                with Timeline() as timeline:
+                    with Timer() as timer:
+                        sess.run(target, **timeline.kwargs())
+                yield timer.elapsed(), timeline.run_metadata
+
+    def run(self, steps, stages=("fw", "train"), warmup=1, trace_every=None, trace_budget=None):
+        """
+        Times `steps` steps after `warmup` untimed ones. Only every `trace_every`-th step, up to `trace_budget` steps,
+        runs with FULL_TRACE (by default every step, or the budget spread evenly over the run); `result.traced_steps`
+        are the steps of `result.metadata`.
+        """
+        trace_every = trace_interval(steps, trace_every, trace_budget)
         ret = []
         for stage, target in [("fw", self._loss), ("train", self._train)]:
             if stage not in stages:
                 continue
             result = ExperimentResult(workers=self._workers, base_model=self._model, batch_size=self._batch_size,
-                                      ordering_algorithm=self._ordering_algorithm, stage=stage, steps=steps)
+                                      ordering_algorithm=self._ordering_algorithm, stage=stage, steps=steps,
+                                      warmup=warmup, trace_every=trace_every, trace_budget=trace_budget,
+                                      ps_tasks=self._ps_tasks, partition_plan=self._partition_plan)
             with tf.train.MonitoredTrainingSession(master=self._master) as sess:
-                # Warm up run
-                sess.run(target)
-                for _ in log_progress(range(steps)):
-                    with Timer() as timer:
+                for _ in range(warmup):
+                    sess.run(target)
+                for step in log_progress(range(steps)):
+                    if step % trace_every == 0 and (trace_budget is None or len(result.traced_steps) < trace_budget):
                         with Timeline() as timeline:
-                            sess.run(target, **timeline.kwargs())
+                            with Timer() as timer:
+                                sess.run(target, **timeline.kwargs())
+                        result.metadata.append(timeline.run_metadata)
+                        result.traced_steps.append(step)
+                    else:
+                        with Timer() as timer:
+                            sess.run(target)
                     result.times.append(timer.elapsed())
-                    result.metadata.append(timeline.run_metadata)
             ret.append(result)
         return ret
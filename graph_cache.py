@@ -0,0 +1,84 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import json
+import os
+from collections import OrderedDict
+
+import tensorflow as tf
+
+from utils import Timer
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class GraphCache:
+    """
+    Built graphs as MetaGraphDefs, kept in memory (the last `memory_size` ones) and in `directory`. On a hit the
+    default graph is replaced by the imported MetaGraphDef instead of being rebuilt; tensors and ops needed afterwards
+    have to be put in graph collections by the builder.
+
+    Entries are keyed by (model, batch_size, workers, ps_tasks, scope) only: remove `directory` after changing the
+    models.
+    """
+
+    def __init__(self, directory="graph_cache", memory_size=4):
+        self._directory = directory
+        self._memory_size = memory_size
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0.0
+
+    def _filename(self, key, extension):
+        return os.path.join(self._directory, "-".join(str(k) for k in key) + extension)
+
+    def _load(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        filename = self._filename(key, ".meta")
+        if not os.path.exists(filename):
+            return None
+        meta_graph = tf.MetaGraphDef()
+        with open(filename, "rb") as fp:
+            meta_graph.ParseFromString(fp.read())
+        with open(self._filename(key, ".json"), "r") as fp:
+            build_time = json.load(fp)["build_time"]
+        self._remember(key, meta_graph, build_time)
+        return meta_graph, build_time
+
+    def _remember(self, key, meta_graph, build_time):
+        self._memory[key] = meta_graph, build_time
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    def _store(self, key, meta_graph, build_time):
+        self._remember(key, meta_graph, build_time)
+        os.makedirs(self._directory, exist_ok=True)
+        for extension, mode, data in ((".meta", "wb", meta_graph.SerializeToString()),
+                                      (".json", "w", json.dumps(dict(build_time=build_time)))):
+            filename = self._filename(key, extension)
+            with open(filename + ".tmp", mode) as fp:
+                fp.write(data)
+            os.replace(filename + ".tmp", filename)
+
+    def get(self, key, build):
+        """Makes the graph of `key` the default graph; on a miss `build()` builds it in the default graph."""
+        tf.reset_default_graph()
+        cached = self._load(key)
+        if cached is None:
+            self.misses += 1
+            with Timer() as timer:
+                build()
+            self._store(key, tf.train.export_meta_graph(), timer.elapsed())
+        else:
+            self.hits += 1
+            meta_graph, build_time = cached
+            with Timer() as timer:
+                tf.train.import_meta_graph(meta_graph)
+            self.saved += max(0.0, build_time - timer.elapsed())
+
+    def __str__(self):
+        return "graph cache: {} hits, {} misses, {:0.1f}s of graph building saved".format(
+            self.hits, self.misses, self.saved)
@@ -0,0 +1,150 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import gzip
+import json
+import re
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def is_recv_name(op_name):
+    return op_name.endswith("/read")
+
+
+def ps_task(device):
+    """Index of the PS task of a device name (0 if it is not on a PS), i.e. the channel its tensors are sent on."""
+    task = re.findall("/job:ps(?:/replica:\\d+)?/task:(\\d+)", device or "")
+    return int(task[0]) if task else 0
+
+
+def is_gradient_name(name):
+    return re.search("(^|/)gradients(_\\d+)?/", name) is not None
+
+
+def tensor_size(tensor):
+    num_elements = tensor.shape.num_elements()
+    return num_elements * tensor.dtype.size if num_elements is not None else 0
+
+
+class GraphIR:
+    """
+    Framework-free tensor-level DAG used by the orderings. Nodes are the tensors reachable from `target`, identified
+    by their index; `inputs[i]` are the input tensors of the op producing node i, `recv[i]` marks parameter reads and
+    `sizes[i]` is the size of the tensor in bytes (0 if unknown) and `devices[i]` the device of its op ("" if unknown).
+    """
+    VERSION = 1
+
+    def __init__(self, names, inputs, recv, target, meta=None, sizes=None, devices=None):
+        self.names = names
+        self.inputs = inputs
+        self.recv = recv
+        self.target = target
+        self.meta = meta or {}
+        self.sizes = sizes or [0] * len(names)
+        self.devices = devices or [""] * len(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def op_name(self, node):
+        return self.names[node].rsplit(":", 1)[0]
+
+    def recv_name(self, node):
+        if not self.recv[node]:
+            return None
+        op_name = self.op_name(node)
+        return op_name[:-5] if is_recv_name(op_name) else op_name
+
+    def channel(self, node):
+        return ps_task(self.devices[node])
+
+    @classmethod
+    def from_tensor(cls, target, meta=None):
+        index = {}
+        names = []
+        inputs = []
+        sizes = []
+        devices = []
+        stack = [target]
+        while stack:
+            tensor = stack.pop()
+            if tensor in index:
+                continue
+            index[tensor] = len(names)
+            names.append(tensor.name)
+            inputs.append(tensor.op.inputs)
+            sizes.append(tensor_size(tensor))
+            devices.append(tensor.op.device)
+            stack.extend(tensor.op.inputs)
+        inputs = [tuple(index[input_tensor] for input_tensor in tensor_inputs) for tensor_inputs in inputs]
+        recv = [is_recv_name(name.rsplit(":", 1)[0]) for name in names]
+        return cls(names, inputs, recv, 0, meta, sizes, devices)
+
+    @classmethod
+    def from_graph_def(cls, graph_def, target, meta=None):
+        def tensor_name(name):
+            return name if ":" in name else "{}:0".format(name)
+
+        op_inputs = {node.name: [tensor_name(i) for i in node.input if not i.startswith("^")]
+                     for node in graph_def.node}
+        op_devices = {node.name: node.device for node in graph_def.node}
+        index = {}
+        names = []
+        stack = [tensor_name(target)]
+        while stack:
+            name = stack.pop()
+            if name in index:
+                continue
+            index[name] = len(names)
+            names.append(name)
+            stack.extend(op_inputs[name.rsplit(":", 1)[0]])
+        inputs = [tuple(index[i] for i in op_inputs[name.rsplit(":", 1)[0]]) for name in names]
+        recv = [is_recv_name(name.rsplit(":", 1)[0]) for name in names]
+        devices = [op_devices[name.rsplit(":", 1)[0]] for name in names]
+        return cls(names, inputs, recv, 0, meta, devices=devices)
+
+    @staticmethod
+    def gradient_sends(graph_def):
+        """
+        (gradient op, variable op) of every optimizer update in `graph_def`, i.e. the tensors a worker pushes to the PS
+        in the train stage. Updates are the `.../update_{variable}/Apply*` ops created by the TF optimizers; with one
+        replica per worker every replica's send (`gradients_{i}/...`) is listed.
+        """
+        sends = []
+        for node in graph_def.node:
+            variable = re.findall("/update_(.+)/Apply\\w+$", node.name)
+            if not variable:
+                continue
+            gradients = [i.rsplit(":", 1)[0] for i in node.input if not i.startswith("^") and is_gradient_name(i)]
+            if gradients:
+                sends.append((gradients[0], variable[0]))
+        return sends
+
+    @classmethod
+    def from_graph(cls, graph, target, meta=None):
+        return cls.from_graph_def(graph.as_graph_def(), target, meta)
+
+    @staticmethod
+    def _open(filename, mode):
+        if filename.endswith(".gz"):
+            return gzip.open(filename, mode + "t")
+        return open(filename, mode)
+
+    @classmethod
+    def load(cls, filename):
+        with cls._open(filename, "r") as fp:
+            data = json.load(fp)
+        if data["version"] != cls.VERSION:
+            raise ValueError("Unsupported graph version {} in {}".format(data["version"], filename))
+        nodes = [node + [0, ""][len(node) - 3:] for node in data["nodes"]]
+        names, inputs, recv, sizes, devices = zip(*nodes) if nodes else ((), (), (), (), ())
+        return cls(list(names), [tuple(i) for i in inputs], [bool(r) for r in recv], data["target"], data["meta"],
+                   list(sizes), list(devices))
+
+    def save(self, filename):
+        data = dict(version=self.VERSION, target=self.target, meta=self.meta,
+                    nodes=[[name, list(inputs), int(recv), size, device]
+                           for name, inputs, recv, size, device in zip(self.names, self.inputs, self.recv, self.sizes,
+                                                                       self.devices)])
+        with self._open(filename, "w") as fp:
+            json.dump(data, fp, separators=(",", ":"))
@@ -0,0 +1,131 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import atexit
+import json
+import socket
+import subprocess
+import sys
+import time
+
+__author__ = 'Sayed Hadi Hashemi'
+
+LOCAL_MASTER = "local"
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(cluster, job_name, task_index):
+    import tensorflow as tf
+    return tf.train.Server(tf.train.ClusterSpec(cluster), job_name=job_name, task_index=task_index,
+                           config=tf.ConfigProto(device_count={"GPU": 0}), start=True)
+
+
+class LocalCluster:
+    """
+    `ps_tasks` PS and `workers` workers on localhost ports, laid out like the real cluster (`/job:ps/task:0`,
+    `/job:worker/task:i`), so `Experiment` runs against `master` unchanged. The servers run in this process or, with
+    `subprocesses`, one process each (stopped at exit).
+    """
+
+    def __init__(self, workers, subprocesses=False, ps_tasks=1):
+        self.cluster = dict(ps=["localhost:{}".format(free_port()) for _ in range(ps_tasks)],
+                            worker=["localhost:{}".format(free_port()) for _ in range(workers)])
+        self._subprocesses = subprocesses
+        self._servers = []
+        self._processes = []
+
+    @property
+    def master(self):
+        return "grpc://{}".format(self.cluster["worker"][0])
+
+    def _tasks(self):
+        for job_name in ("ps", "worker"):
+            for task_index in range(len(self.cluster[job_name])):
+                yield job_name, task_index
+
+    def start(self, timeout=60):
+        if self._subprocesses:
+            for job_name, task_index in self._tasks():
+                self._processes.append(subprocess.Popen(
+                    [sys.executable, __file__, "--cluster", json.dumps(self.cluster), "--job", job_name, "--task",
+                     str(task_index)]))
+            atexit.register(self.stop)
+        else:
+            self._servers = [start_server(self.cluster, job_name, task_index) for job_name, task_index in self._tasks()]
+        self.wait_ready(timeout)
+        return self
+
+    def wait_ready(self, timeout=60):
+        """Blocks until every task accepts connections; raises RuntimeError if a task died or on timeout."""
+        deadline = time.time() + timeout
+        for address in self.cluster["ps"] + self.cluster["worker"]:
+            host, port = address.rsplit(":", 1)
+            while True:
+                failed = [process.args for process in self._processes if process.poll() is not None]
+                if failed:
+                    self.stop()
+                    raise RuntimeError("Local cluster task exited: {}".format(" ".join(failed[0])))
+                try:
+                    socket.create_connection((host, int(port)), timeout=1).close()
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        self.stop()
+                        raise RuntimeError("Local cluster task {} not ready after {}s".format(address, timeout))
+                    time.sleep(0.1)
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.wait()
+        self._processes = []
+        self._servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def resolve_master(master, workers, subprocesses=False, ps_tasks=1):
+    """
+    (master, cluster): `master` and None, or if it is "local" the master of a new, ready `LocalCluster` of `workers`
+    workers and the cluster itself. The caller keeps the cluster (in-process servers live as long as it does) and
+    stops it when done.
+    """
+    if master != LOCAL_MASTER:
+        return master, None
+    cluster = LocalCluster(workers, subprocesses, ps_tasks).start()
+    print("Local cluster: {}".format(json.dumps(cluster.cluster)))
+    return cluster.master, cluster
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Runs a local TF cluster (or one task of it).")
+    parser.add_argument("workers", help="Number of workers", type=int, nargs="?", default=1)
+    parser.add_argument("-p", "--ps-tasks", help="Number of PS tasks", type=int, default=1)
+    parser.add_argument("--cluster", help="Cluster spec (JSON) of the task to run")
+    parser.add_argument("--job", help="Job name of the task to run", choices=["ps", "worker"])
+    parser.add_argument("--task", help="Task index of the task to run", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.cluster:
+        start_server(json.loads(args.cluster), args.job, args.task).join()
+    else:
+        cluster = LocalCluster(args.workers, subprocesses=True, ps_tasks=args.ps_tasks).start()
+        print("Master: {}".format(cluster.master))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
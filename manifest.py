@@ -0,0 +1,48 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import json
+import os
+from collections import OrderedDict
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+class Manifest:
+    """
+    The (model, algorithm, stage) cells of an experiment matrix with their status ("pending", "done" or "failed"),
+    number of attempts, last error and wall time. Saved atomically to `filename` after every change.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self.cells = OrderedDict()
+        if os.path.exists(filename):
+            with open(filename, "r") as fp:
+                self.cells = json.load(fp, object_pairs_hook=OrderedDict)["cells"]
+
+    def add(self, name, **cell):
+        if name not in self.cells:
+            self.cells[name] = dict(status="pending", attempts=0, wall_time=None, error=None, **cell)
+        return self.cells[name]
+
+    def update(self, name, **kwargs):
+        self.cells[name].update(kwargs)
+        self.save()
+
+    def save(self):
+        tmp = self._filename + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(dict(cells=self.cells), fp, indent=1)
+        os.replace(tmp, self._filename)
+
+    def estimate(self, names):
+        """Expected wall time of `names`, from the cells of the same model (or any cell) that are done."""
+        done = [cell for cell in self.cells.values() if cell["wall_time"] is not None]
+        if not done:
+            return None
+        total = 0
+        for name in names:
+            same_model = [cell["wall_time"] for cell in done if cell.get("model") == self.cells[name].get("model")]
+            times = same_model or [cell["wall_time"] for cell in done]
+            total += sum(times) / len(times)
+        return total
@@ -41,7 +41,25 @@ class ToyModel:
                 return model, inputs
 
 
-def get_base_graph(net, batch_size=16, scope=None):
+def partitioning_getter(partition_plan):
+    """
+    Custom getter creating the variables of `partition_plan` ({variable name without the model scope: chunks}) as
+    partitioned variables, split along their last axis.
+    """
+    def getter(next_getter, name, *args, **kwargs):
+        chunks = partition_plan.get(name.split("/", 1)[-1])
+        shape = kwargs.get("shape")
+        if chunks and shape is not None and kwargs.get("partitioner") is None:
+            kwargs["partitioner"] = tf.fixed_size_partitioner(chunks, axis=len(shape) - 1)
+        return next_getter(name, *args, **kwargs)
+    return getter
+
+
+def get_base_graph(net, batch_size=16, scope=None, partition_plan=None):
+    if partition_plan:
+        with tf.variable_scope(tf.get_variable_scope(), custom_getter=partitioning_getter(partition_plan)):
+            return get_base_graph(net, batch_size, scope)
+
     labels = tf.random_uniform([batch_size, 1000], name="Labels")
 
     if net == "inception_v3":
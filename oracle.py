@@ -1,79 +1,384 @@
 #! /usr/bin/env python -u
 # coding=utf-8
+import argparse
+import functools
 import json
+import math
+import multiprocessing
 import re
-import tensorflow as tf
+
+import numpy as np
 
 __author__ = 'Sayed Hadi Hashemi'
 
 
+class DurationSketch:
+    """
+    Bounded-memory summary of the durations of one op: exact count, sum, min and max plus a log-bucketed histogram
+    with `accuracy` relative error on quantiles. Past `max_buckets` the lowest buckets are collapsed together.
+    """
+
+    def __init__(self, accuracy=0.02, max_buckets=128):
+        self.accuracy = accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.zeros = 0
+        self.buckets = {}
+
+    def _index(self, duration):
+        return int(math.ceil(math.log(duration, self._gamma)))
+
+    def _value(self, index):
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, duration, count=1):
+        self.count += count
+        self.total += duration * count
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = duration if self.max is None else max(self.max, duration)
+        if duration <= 0:
+            self.zeros += count
+        else:
+            index = self._index(duration)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+            self._collapse()
+
+    def _collapse(self):
+        while len(self.buckets) > self.max_buckets:
+            lowest, second = sorted(self.buckets)[:2]
+            self.buckets[second] += self.buckets.pop(lowest)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self._collapse()
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return min(self.max, max(self.min, self._value(index)))
+        return self.max
+
+    def get(self, statistic="min"):
+        if statistic == "min":
+            return self.min
+        elif statistic == "max":
+            return self.max
+        elif statistic == "mean":
+            return self.mean()
+        else:
+            return self.quantile(float(statistic))
+
+    def to_json(self):
+        ret = dict(n=self.count, sum=self.total, min=self.min, max=self.max)
+        if self.zeros:
+            ret["zeros"] = self.zeros
+        if self.buckets:
+            ret["b"] = [value for index in sorted(self.buckets) for value in (index, self.buckets[index])]
+        return ret
+
+    @classmethod
+    def from_json(cls, data, accuracy=0.02, max_buckets=128):
+        sketch = cls(accuracy, max_buckets)
+        if not isinstance(data, dict):
+            # Legacy oracles only kept the minimum duration.
+            sketch.add(data)
+            return sketch
+        sketch.count = data["n"]
+        sketch.total = data["sum"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        sketch.zeros = data.get("zeros", 0)
+        if "b" in data:
+            sketch.buckets = dict(zip(data["b"][::2], data["b"][1::2]))
+        return sketch
+
+
+def parse_statistic(statistic):
+    if statistic in ("min", "max", "mean"):
+        return statistic
+    q = float(statistic)
+    if not 0 <= q <= 1:
+        raise ValueError("A quantile must be in [0, 1]: {}".format(statistic))
+    return q
+
+
 class TimeOracle:
-    def __init__(self, scope=None):
+    VERSION = 2
+
+    def __init__(self, scope=None, accuracy=0.02, max_buckets=128):
         self._time = {}
         self._scope = scope
+        self._accuracy = accuracy
+        self._max_buckets = max_buckets
+        # Name resolution is compiled once for the scope; resolved names and durations are memoized until ops change.
+        scope = re.escape(str(scope))
+        self._prefixes = [(re.compile("^{0}(?:_\\d+)?/{0}/(.*)$".format(scope)), "//"),
+                          (re.compile("^{0}(?:_\\d+)?/(.*)$".format(scope)), "/")]
+        self._index = {}
+        self._values = {}
+        # For `query_many`: row of each op (and of each scoped name resolved so far) and a column per statistic.
+        self._rows = None
+        self._columns = {}
 
     @classmethod
-    def load(cls, filename, scope):
-        with open(filename, "r") as fp:
-            _time = json.load(fp)
-        oracle = cls()
-        oracle._time = _time
-        oracle._scope = scope
+    def from_json(cls, data, scope):
+        if data.get("version") == cls.VERSION:
+            oracle = cls(scope, data["accuracy"], data["max_buckets"])
+            ops = data["ops"]
+        else:
+            oracle = cls(scope)
+            ops = data
+        oracle._time = {op_name: DurationSketch.from_json(sketch, oracle._accuracy, oracle._max_buckets)
+                        for op_name, sketch in ops.items()}
         return oracle
 
+    @classmethod
+    def load(cls, filename, scope, **match):
+        """
+        Loads an oracle file, or, from an `OracleStore` database (*.db), the entry best matching `match` (model,
+        batch_size, workers, tf_version, hardware).
+        """
+        if filename.endswith(".db"):
+            from oracle_store import OracleStore
+            return OracleStore(filename).load(scope, **match)
+        with open(filename, "r") as fp:
+            return cls.from_json(json.load(fp), scope)
+
+    def dumps(self):
+        # One op per line, so that oracles stay diff-able when versioned next to `rpc_orders.h`.
+        header = json.dumps(dict(version=self.VERSION, accuracy=self._accuracy, max_buckets=self._max_buckets))
+        ops = ['{}: {}'.format(json.dumps(op_name), json.dumps(self._time[op_name].to_json(), sort_keys=True,
+                                                                separators=(",", ":")))
+               for op_name in sorted(self._time)]
+        return '{}, "ops": {{\n{}\n}}}}\n'.format(header[:-1], ",\n".join(ops))
+
     def save(self, filename):
         with open(filename, "w") as fp:
-            json.dump(self._time, fp, indent=2, sort_keys=True)
+            fp.write(self.dumps())
+
+    @staticmethod
+    def _parse(trace):
+        if isinstance(trace, str):
+            with open(trace, "rb") as fp:
+                trace = fp.read()
+        if isinstance(trace, bytes):
+            import tensorflow as tf
+            return tf.RunMetadata.FromString(trace)
+        return trace
+
+    def _sketch(self, op_name):
+        if op_name not in self._time:
+            self._time[op_name] = DurationSketch(self._accuracy, self._max_buckets)
+            self._index = {}
+            self._rows = None
+        self._values = {}
+        self._columns = {}
+        return self._time[op_name]
+
+    def _add(self, op_name, duration):
+        if op_name:
+            self._sketch(op_name).add(duration)
 
     def update(self, metadata):
-        metadata_copy = tf.RunMetadata()
-        metadata_copy.CopyFrom(metadata)
-        all_ops = []
-        for device in [d for d in metadata_copy.step_stats.dev_stats if "worker" in d.device]:
-            all_ops += device.node_stats
+        metadata = self._parse(metadata)
+        recv_ops = []
+        for device in metadata.step_stats.dev_stats:
+            if "worker" not in device.device:
+                continue
+            for op in device.node_stats:
+                if op.node_name == "RecvTensor":
+                    recv_ops.append((device.device, op))
+                else:
+                    self._add(self.remove_prefix(op.node_name), op.all_end_rel_micros)
 
-        last_end = 0
-        for op in sorted(all_ops, key=lambda a: a.all_start_micros + a.all_end_rel_micros):
-            if op.node_name == "RecvTensor":
-                op_start = max(op.all_start_micros, last_end - 1)
-                op_end = op.all_start_micros + op.all_end_rel_micros
-                op.all_start_micros = op_start
-                op.op_end_rel_micros = op_end - op_start
-                op.all_end_rel_micros = op_end - op_start
-                last_end = op_end
-                op_name = self.recvop_name(op)
-            else:
-                op_name = self.remove_prefix(op.node_name)
-            if op_name:
-                self._time[op_name] = min(op.all_end_rel_micros, self._time.get(op_name, op.all_end_rel_micros))
+        for _, op, op_start, op_end in serialized_transfers(recv_ops):
+            self._add(self.recvop_name(op), op_end - op_start)
 
-    def query(self, name):
-        fixed_name = self.remove_prefix(name)
-        if fixed_name in self._time:
-            return self._time[fixed_name]
+    def merge(self, other):
+        for op_name, sketch in other._time.items():
+            self._sketch(op_name).merge(sketch)
+        return self
 
-        recv_name = "recv:{}".format(fixed_name)
-        if recv_name in self._time:
-            return self._time[recv_name]
-        else:
+    def durations(self, statistic="min"):
+        """{op name: duration} of all ops, with the names as stored (without scope)."""
+        return {op_name: sketch.get(statistic) for op_name, sketch in self._time.items()}
+
+    def overlay(self, other):
+        """New oracle with the durations of `other` for the ops it has and of this oracle for the rest."""
+        oracle = TimeOracle(self._scope, self._accuracy, self._max_buckets)
+        oracle._time = dict(self._time)
+        oracle._time.update(other._time)
+        return oracle
+
+    def update_many(self, traces, processes=None, chunk_size=8):
+        """
+        `traces` is an iterable of RunMetadata, serialized RunMetadata or filenames of serialized RunMetadata. With
+        `processes`, chunks of traces are ingested by a process pool and the partial oracles are merged in order.
+        """
+        if not processes:
+            for trace in traces:
+                self.update(trace)
+            return self
+
+        def chunks():
+            chunk = []
+            for trace in traces:
+                chunk.append(trace if isinstance(trace, (str, bytes)) else trace.SerializeToString())
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        # Spawned, not forked: this runs after TF sessions (and maybe in-process servers), which do not survive a fork.
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            ingest = functools.partial(_partial_oracle, scope=self._scope, accuracy=self._accuracy,
+                                       max_buckets=self._max_buckets)
+            for partial in pool.imap(ingest, chunks()):
+                self.merge(partial)
+        return self
+
+    def _resolve(self, name):
+        if name not in self._index:
+            fixed_name = self.remove_prefix(name)
+            recv_name = "recv:{}".format(fixed_name)
+            if fixed_name in self._time:
+                self._index[name] = fixed_name
+            else:
+                self._index[name] = recv_name if recv_name in self._time else None
+        return self._index[name]
+
+    def query(self, name, statistic="min"):
+        """`statistic` is "min", "mean", "max" or a quantile in [0, 1]."""
+        op_name = self._resolve(name)
+        if op_name is None:
             return None
+        values = self._values.setdefault(statistic, {})
+        if op_name not in values:
+            values[op_name] = self._time[op_name].get(statistic)
+        return values[op_name]
+
+    def _scoped_name(self, op_name):
+        """The name a graph queries `op_name` by (inverse of `remove_prefix` and of the recv: prefix)."""
+        name = op_name[5:] if op_name.startswith("recv:") else op_name
+        if name.startswith("//"):
+            return "{0}/{0}/{1}".format(self._scope, name[2:])
+        if name.startswith("/"):
+            return "{}/{}".format(self._scope, name[1:])
+        return name
+
+    def _compile(self):
+        ops = list(self._time)
+        self._rows = {}
+        # Recv ops first, so that a comp op of the same name takes precedence as in `_resolve`.
+        for row, op_name in sorted(enumerate(ops), key=lambda item: not item[1].startswith("recv:")):
+            self._rows[op_name] = row
+            scoped = self._scoped_name(op_name)
+            if self._resolve(scoped) == op_name:
+                self._rows[scoped] = row
+
+    def _column(self, statistic):
+        if statistic not in self._columns:
+            # One extra NaN row that names missing from the oracle point to.
+            self._columns[statistic] = np.array([sketch.get(statistic) for sketch in self._time.values()] + [math.nan],
+                                                dtype=np.float64)
+        return self._columns[statistic]
+
+    def _row(self, name):
+        row = self._rows.get(name)
+        if row is None:
+            op_name = self._resolve(name)
+            row = self._rows[name] = self._rows[op_name] if op_name is not None else len(self._time)
+        return row
+
+    def query_many(self, names, statistic="min"):
+        """
+        Durations of `names` as a float array aligned with them; NaN where the oracle has no such op. Names are
+        mapped to rows of a per-statistic column (compiled on the first call for the current ops) and gathered at once.
+        """
+        if self._rows is None:
+            self._compile()
+        rows = np.fromiter((self._row(name) for name in names), dtype=np.intp, count=len(names))
+        return self._column(statistic)[rows]
 
     def remove_prefix(self, name):
-        # 2
-        op_name = re.findall("^{scope}(?:_\d+)?/{scope}/(.*)$".format(scope=self._scope), name)
-        if op_name:
-            return "//" + op_name[0]
-        # 1
-        op_name = re.findall("^{scope}(?:_\d+)?/(.*)$".format(scope=self._scope), name)
-        if op_name:
-            return "/" + op_name[0]
-        # 0
+        for pattern, prefix in self._prefixes:
+            op_name = pattern.match(name)
+            if op_name:
+                return prefix + op_name.group(1)
         return name
 
+    @staticmethod
+    def recv_source(op):
+        """Device a RecvTensor op receives from, i.e. its PS channel."""
+        source = re.findall(" from (\\S+)", op.timeline_label)
+        return source[0] if source else None
+
     def recvop_name(self, op):
-        # TODO(xldrx): extends the support beyond MR+PS.
         tensorname = re.findall(".* edge_\d+_(.+)/read from .*", op.timeline_label)
         if tensorname:
             op_name = "recv:{}".format(self.remove_prefix(tensorname[0]))
             return op_name
         return None
+
+
+def serialized_transfers(recv_ops):
+    """
+    `recv_ops` are the (device, RecvTensor op) of one step. A transfer can not start before the previous one from the
+    same PS has finished on its channel; yields (device, op, start, end) with the start adjusted accordingly.
+    """
+    channels = {}
+    for device, op in recv_ops:
+        channels.setdefault(TimeOracle.recv_source(op), []).append(
+            (op.all_start_micros + op.all_end_rel_micros, device, op))
+    for channel_ops in channels.values():
+        last_end = 0
+        for op_end, device, op in sorted(channel_ops, key=lambda a: a[0]):
+            op_start = max(op.all_start_micros, last_end - 1)
+            last_end = op_end
+            yield device, op, op_start, op_end
+
+
+def _partial_oracle(traces, scope, accuracy, max_buckets):
+    return TimeOracle(scope, accuracy, max_buckets).update_many(traces)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Builds a time oracle from serialized RunMetadata files.")
+    parser.add_argument("output", help="Output oracle e.g. time-oracle-vgg16.json")
+    parser.add_argument("traces", help="Serialized RunMetadata files", nargs="+")
+    parser.add_argument("-s", "--scope", help="Model scope e.g. vgg16-none", default=None)
+    parser.add_argument("-j", "--processes", help="Number of worker processes", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    TimeOracle(args.scope).update_many(args.traces, processes=args.processes).save(args.output)
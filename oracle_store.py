@@ -0,0 +1,142 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import json
+import math
+import sqlite3
+import time
+
+from oracle import TimeOracle
+
+__author__ = 'Sayed Hadi Hashemi'
+
+KEY = ("model", "batch_size", "workers", "ps_tasks", "tf_version", "hardware")
+
+
+class OracleStore:
+    """
+    SQLite database of time oracles, one entry per (model, batch size, workers, PS tasks, TF version, hardware tag).
+    New profiles are merged into their entry, whose revision is bumped, so no timing that was paid for is lost.
+    Oracles hold scope-free op names; the scope is given when an entry is loaded.
+    """
+    SCHEMA_VERSION = 1
+
+    def __init__(self, filename="oracles.db"):
+        self.filename = filename
+        self._db = sqlite3.connect(filename, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("CREATE TABLE IF NOT EXISTS oracles (model TEXT, batch_size INTEGER, workers INTEGER, "
+                         "ps_tasks INTEGER, tf_version TEXT, hardware TEXT, revision INTEGER, steps INTEGER, "
+                         "updated REAL, oracle TEXT, PRIMARY KEY ({}))".format(", ".join(KEY)))
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            self._db.execute("PRAGMA user_version = {}".format(self.SCHEMA_VERSION))
+        elif version != self.SCHEMA_VERSION:
+            raise ValueError("Unsupported oracle store version {}: {}".format(version, filename))
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def _key(model, batch_size, workers, ps_tasks=1, tf_version="", hardware=""):
+        return model, batch_size, workers, ps_tasks, tf_version, hardware
+
+    def _get(self, key):
+        return self._db.execute("SELECT * FROM oracles WHERE {}".format(" AND ".join(k + " = ?" for k in KEY)),
+                                key).fetchone()
+
+    def add(self, oracle, steps, **key):
+        """Merges `oracle`, profiled over `steps` steps, into the entry of `key` and returns its revision."""
+        key = self._key(**key)
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._get(key)
+            if row is not None:
+                merged = TimeOracle.from_json(json.loads(row["oracle"]), None).merge(oracle)
+                revision, steps = row["revision"] + 1, row["steps"] + steps
+            else:
+                merged, revision = oracle, 1
+            self._db.execute("INSERT OR REPLACE INTO oracles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             key + (revision, steps, time.time(), merged.dumps()))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return revision
+
+    def entries(self, model=None):
+        query = "SELECT {}, revision, steps, updated FROM oracles".format(", ".join(KEY))
+        if model is None:
+            return [dict(row) for row in self._db.execute(query + " ORDER BY " + ", ".join(KEY))]
+        return [dict(row) for row in self._db.execute(query + " WHERE model = ? ORDER BY " + ", ".join(KEY),
+                                                      (model,))]
+
+    def fresh(self, max_age=None, min_steps=0, **key):
+        """
+        The entry of exactly `key` if it was updated less than `max_age` seconds ago with `min_steps` steps. Without
+        `max_age` no entry is fresh, so that the model is profiled again and the profile merged into the entry.
+        """
+        if max_age is None:
+            return None
+        row = self._get(self._key(**key))
+        if row is None or row["steps"] < min_steps or time.time() - row["updated"] > max_age:
+            return None
+        return row
+
+    def best(self, model, batch_size=None, workers=None, ps_tasks=None, tf_version=None, hardware=None):
+        """
+        The entry of `model` best matching the rest: same hardware first, then TF version, cluster shape and the
+        closest batch size; the most recent one breaks ties. Unset fields match anything.
+        """
+        def score(row):
+            return (hardware is None or row["hardware"] == hardware,
+                    tf_version is None or row["tf_version"] == tf_version,
+                    (workers is None or row["workers"] == workers) + (ps_tasks is None or row["ps_tasks"] == ps_tasks),
+                    -abs(math.log(row["batch_size"] / batch_size)) if batch_size else 0,
+                    row["updated"])
+
+        rows = self._db.execute("SELECT * FROM oracles WHERE model = ?", (model,)).fetchall()
+        return max(rows, key=score) if rows else None
+
+    def load(self, scope, model, **match):
+        row = self.best(model, **match)
+        if row is None:
+            raise ValueError("No time oracle of {} in {}".format(model, self.filename))
+        return TimeOracle.from_json(json.loads(row["oracle"]), scope)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Lists, imports and exports the time oracles of an oracle store.")
+    parser.add_argument("store", help="Oracle store e.g. oracles.db")
+    parser.add_argument("-m", "--model", help="Model of the entries")
+    parser.add_argument("-b", "--batch-size", help="Batch size of the entry", type=int)
+    parser.add_argument("-w", "--workers", help="Number of workers of the entry", type=int)
+    parser.add_argument("-p", "--ps-tasks", help="Number of PS tasks of the entry", type=int)
+    parser.add_argument("--tf-version", help="TF version of the entry")
+    parser.add_argument("--hardware", help="Hardware tag of the entry")
+    parser.add_argument("--import", help="Merges an oracle file (e.g. time-oracle-vgg16.json) into the entry",
+                        dest="import_file")
+    parser.add_argument("--steps", help="Number of steps the imported oracle was profiled over", type=int, default=0)
+    parser.add_argument("--export", help="Writes the best matching entry as an oracle file")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    store = OracleStore(args.store)
+    match = dict(batch_size=args.batch_size, workers=args.workers, ps_tasks=args.ps_tasks,
+                 tf_version=args.tf_version, hardware=args.hardware)
+    if args.import_file:
+        if None in (args.model, args.batch_size, args.workers):
+            raise ValueError("--import needs --model, --batch-size and --workers")
+        key = dict(match, ps_tasks=args.ps_tasks or 1, tf_version=args.tf_version or "",
+                   hardware=args.hardware or "")
+        revision = store.add(TimeOracle.load(args.import_file, None), args.steps, model=args.model, **key)
+        print("{}: revision {}".format(args.model, revision))
+    elif args.export:
+        store.load(None, args.model, **match).save(args.export)
+    else:
+        print("\t".join(KEY + ("revision", "steps", "updated")))
+        for entry in store.entries(args.model):
+            entry["updated"] = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["updated"]))
+            print("\t".join(str(entry[column]) for column in KEY + ("revision", "steps", "updated")))
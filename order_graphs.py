@@ -0,0 +1,81 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+from collections import OrderedDict
+
+from graph_ir import GraphIR
+from oracle import TimeOracle, parse_statistic
+from priority_table import PriorityTable, graph_fingerprint
+from wizard import TAO, TIO, priority_print, send_priorities
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def graph_filename(scope):
+    return "graph-{}.json.gz".format(scope)
+
+
+def oracle_filename(model):
+    return "time-oracle-{}.json".format(model)
+
+
+def graph_oracle(graph, oracle):
+    """`oracle` as seen by `graph`: the parts of partitioned variables missing from it are estimated from the whole
+    variables."""
+    if graph.meta.get("partition_plan"):
+        from partition_planner import PartitionedOracle, graph_parts
+        return PartitionedOracle(oracle, graph_parts(graph))
+    return oracle
+
+
+def with_sends(graph, priorities):
+    """The read `priorities` of `graph` followed by the priorities of its gradient sends (`meta["sends"]`)."""
+    return priorities + send_priorities(graph.meta.get("sends", []), priorities)
+
+
+def get_priorities(graph, statistic="min", oracle_store=None):
+    """
+    Priorities of the parameter reads and then of the gradient sends of `graph`. TAO uses `time-oracle-{model}.json`,
+    or the entry of `oracle_store` best matching the graph (see `graph_oracle`).
+    """
+    if graph.meta["algorithm"] == "TAO":
+        if oracle_store:
+            oracle = TimeOracle.load(oracle_store, graph.meta["scope"], model=graph.meta["model"],
+                                     batch_size=graph.meta.get("batch_size"), ps_tasks=graph.meta.get("ps_tasks"))
+        else:
+            oracle = TimeOracle.load(oracle_filename(graph.meta["model"]), graph.meta["scope"])
+        priorities = TAO(graph, graph_oracle(graph, oracle), statistic).get_priorities()
+    elif graph.meta["algorithm"] == "TIO":
+        priorities = TIO(graph).get_priorities()
+    else:
+        raise ValueError("Unknown ordering algorithm: {}".format(graph.meta["algorithm"]))
+    return with_sends(graph, priorities)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Computes the orderings from exported graphs, without TensorFlow.")
+    parser.add_argument("graphs", help="Graphs exported by 0_extract_orders.py e.g. graph-vgg16-TAO.json.gz",
+                        nargs="+")
+    parser.add_argument("-o", "--output", help="Output header", default="rpc_orders.h")
+    parser.add_argument("-t", "--table", help="Also write the priorities as a binary table (see priority_table.py)",
+                        default="rpc_orders.bin")
+    parser.add_argument("-s", "--statistic", help="Op durations used by TAO: min, mean, max or a quantile e.g. 0.9",
+                        type=parse_statistic, default="min")
+    parser.add_argument("--oracle-store", help="Take TAO's time oracles from this oracle store (e.g. oracles.db) "
+                                               "instead of time-oracle-{model}.json")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    priorities_dict = OrderedDict()
+    fingerprints = {}
+    for filename in args.graphs:
+        graph = GraphIR.load(filename)
+        print("//{}".format(graph.meta["scope"]))
+        priorities_dict[graph.meta["scope"]] = get_priorities(graph, args.statistic, args.oracle_store)
+        fingerprints[graph.meta["scope"]] = graph_fingerprint(graph)
+
+    with open(args.output, "w") as fp:
+        fp.write(priority_print(priorities_dict))
+    PriorityTable.from_priorities(priorities_dict, fingerprints).save(args.table)
@@ -0,0 +1,218 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import json
+import re
+from collections import OrderedDict
+
+from graph_ir import GraphIR
+from oracle import TimeOracle, parse_statistic
+from order_graphs import oracle_filename
+from report import bootstrap_ratio
+from simulator import Link, Simulator
+from trace_store import load_result, untraced_times
+from wizard import TAO
+
+__author__ = 'Sayed Hadi Hashemi'
+
+CHUNKS = (2, 4, 8, 16)
+
+
+def variable_name(graph, node):
+    """Name of the variable read by `node` without the model scope, i.e. the key of a partition plan."""
+    return graph.recv_name(node).split("/", 1)[-1]
+
+
+def ps_device(device, task):
+    if re.search("/job:ps", device or ""):
+        return re.sub("/task:\\d+", "/task:{}".format(task), device)
+    return "/job:ps/task:{}".format(task)
+
+
+def partition_graph(graph, plan):
+    """
+    Rewrites `graph` as if the variables of `plan` ({variable name: chunks}) were created by
+    `tf.fixed_size_partitioner`: each read becomes `chunks` reads of `{variable}/part_{i}`, placed round-robin over the
+    PS tasks starting at the task of the variable, and its consumers read their concatenation.
+    """
+    names, inputs, recv, sizes, devices = (list(graph.names), list(graph.inputs), list(graph.recv),
+                                           list(graph.sizes), list(graph.devices))
+    ps_tasks = graph.meta.get("ps_tasks") or max(map(graph.channel, range(len(graph))), default=0) + 1
+    for node in range(len(graph)):
+        chunks = plan.get(variable_name(graph, node)) if graph.recv[node] else None
+        if not chunks:
+            continue
+        variable = graph.recv_name(node)
+        part_nodes = []
+        for i in range(chunks):
+            part_nodes.append(len(names))
+            names.append("{}/part_{}/read:0".format(variable, i))
+            inputs.append(())
+            recv.append(True)
+            sizes.append(graph.sizes[node] // chunks + (i < graph.sizes[node] % chunks))
+            devices.append(ps_device(graph.devices[node], (graph.channel(node) + i) % ps_tasks))
+        # The read itself becomes the concatenation, so its consumers are left untouched.
+        names[node] = variable + "/concat:0"
+        inputs[node] = tuple(part_nodes)
+        recv[node] = False
+        devices[node] = ""
+    meta = dict(graph.meta, partition_plan=dict(plan))
+    return GraphIR(names, inputs, recv, graph.target, meta, sizes, devices)
+
+
+def graph_parts(graph):
+    """{part name: (variable name, chunks)} of the partitioned variables of `graph` (`meta["partition_plan"]`)."""
+    plan = graph.meta.get("partition_plan") or {}
+    parts = {}
+    for node in range(len(graph)):
+        if graph.recv[node]:
+            variable, _, part = graph.recv_name(node).rpartition("/part_")
+            if part.isdigit() and variable.split("/", 1)[-1] in plan:
+                parts[graph.recv_name(node)] = (variable, plan[variable.split("/", 1)[-1]])
+    return parts
+
+
+class PartitionedOracle:
+    """
+    Time oracle of a graph with partitioned variables (see `graph_parts`), falling back on the oracle profiled
+    without them: a part not in `oracle` takes its share of the whole transfer, and the other ops of a partitioned
+    variable (its concatenation) take `concat_time` microseconds.
+    """
+
+    def __init__(self, oracle, parts, concat_time=1):
+        self._oracle = oracle
+        self._parts = parts
+        self._variables = sorted({variable + "/" for variable, _ in parts.values()})
+        self._concat_time = concat_time
+
+    def query(self, name, statistic="min"):
+        time = self._oracle.query(name, statistic)
+        if time is not None:
+            return time
+        if name in self._parts:
+            variable, chunks = self._parts[name]
+            time = self._oracle.query(variable, statistic)
+            return time / chunks if time is not None else None
+        if any(name.startswith(variable) for variable in self._variables):
+            return self._concat_time
+        return None
+
+
+class PartitionPlanner:
+    """
+    Picks the variables to partition and their number of chunks. Starting from the variables with the longest
+    transfers, each candidate is split into each of `chunks` parts in turn; the rewritten graph is ordered by TAO and
+    its iteration simulated, and the best split is kept if it shortens the iteration by more than `min_gain`. Splits
+    pay off when the parts of a large transfer go over several PS channels; the `link` latency is paid per part.
+    """
+
+    def __init__(self, graph, oracle, link=None, statistic="min", chunks=CHUNKS, min_gain=0.01, candidates=8):
+        self._graph = graph
+        self._oracle = oracle
+        self._link = link or Link()
+        self._statistic = statistic
+        self._chunks = chunks
+        self._min_gain = min_gain
+        self._candidates = candidates
+
+    def variables(self):
+        """Names of the `candidates` variables with the longest transfers, longest first."""
+        times = {}
+        for node in range(len(self._graph)):
+            if self._graph.recv[node]:
+                time = self._oracle.query(self._graph.recv_name(node), self._statistic) or TAO.MISSING_TIME
+                times[variable_name(self._graph, node)] = self._link.transfer_time(self._graph.sizes[node], time)
+        return sorted(times, key=times.get, reverse=True)[:self._candidates]
+
+    def evaluate(self, plan):
+        """Simulated iteration time (us) of the graph partitioned by `plan` under its TAO ordering."""
+        graph = partition_graph(self._graph, plan)
+        oracle = PartitionedOracle(self._oracle, graph_parts(graph))
+        priorities = TAO(graph, oracle, self._statistic).get_priorities()
+        return Simulator(graph, oracle, self._link, self._statistic).simulate(priorities).makespan
+
+    def plan(self):
+        """Returns the plan and the simulated iteration times before and after it."""
+        plan = OrderedDict()
+        before = best = self.evaluate(plan)
+        for variable in self.variables():
+            trials = {chunks: self.evaluate(dict(plan, **{variable: chunks})) for chunks in self._chunks}
+            chunks = min(trials, key=trials.get)
+            if trials[chunks] < best * (1 - self._min_gain):
+                plan[variable] = chunks
+                best = trials[chunks]
+        return plan, before, best
+
+
+def load_plan(filename, model):
+    """{variable name: chunks} planned for `model` in a file written by this script (empty if none)."""
+    with open(filename, "r") as fp:
+        return json.load(fp).get(model, {}).get("variables", {})
+
+
+def measured_speedups(baseline, partitioned, resamples=2000, alpha=0.05, seed=0):
+    """
+    {model: [speedup rows]} of the `partitioned` results over the `baseline` results of the same model, ordering,
+    stage and workers, from their untraced step times (> 1 is faster).
+    """
+    def key(result):
+        return result.base_model, result.ordering_algorithm, result.stage, result.workers
+
+    baselines = {key(result): result for result in map(load_result, baseline)}
+    speedups = {}
+    for result in map(load_result, partitioned):
+        old = baselines.get(key(result))
+        if old is None:
+            continue
+        speedup, lower, upper = bootstrap_ratio(untraced_times(old), untraced_times(result), resamples, alpha, seed)
+        speedups.setdefault(result.base_model, []).append(dict(
+            algorithm=result.ordering_algorithm, stage=result.stage, workers=result.workers, value=speedup,
+            lower=lower, upper=upper))
+    return speedups
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plans which variables to partition, and into how many chunks.")
+    parser.add_argument("graphs", help="Graphs exported by 0_extract_orders.py e.g. graph-vgg16-TAO.json.gz",
+                        nargs="+")
+    parser.add_argument("-t", "--time-oracle", help="Time oracle (default: time-oracle-{model}.json)")
+    parser.add_argument("-b", "--bandwidth", help="PS->worker bandwidth in Gbit/s (default: oracle transfer times)",
+                        type=float)
+    parser.add_argument("-l", "--latency", help="Per-transfer latency in microseconds, paid by every part",
+                        type=float, default=50)
+    parser.add_argument("-w", "--workers", help="Number of workers sharing the PS link", type=int, default=1)
+    parser.add_argument("-s", "--statistic", help="Op durations: min, mean, max or a quantile e.g. 0.9",
+                        type=parse_statistic, default="min")
+    parser.add_argument("--chunks", help="Numbers of chunks tried per variable", type=int, nargs="+",
+                        default=list(CHUNKS))
+    parser.add_argument("--candidates", help="Number of largest variables considered", type=int, default=8)
+    parser.add_argument("--min-gain", help="Minimum predicted gain of a split", type=float, default=0.01)
+    parser.add_argument("--baseline", help="Results of the unpartitioned models (report the measured gains)",
+                        nargs="+", default=[])
+    parser.add_argument("--partitioned", help="Results of the partitioned models (see 1_run_experiments.py "
+                                              "--partition-plan)", nargs="+", default=[])
+    parser.add_argument("-o", "--output", help="Plan and predicted/measured gains per model",
+                        default="partition_plan.json")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    link = Link(args.bandwidth * 1e9 / 8 if args.bandwidth else None, args.latency, args.workers)
+    measured = measured_speedups(args.baseline, args.partitioned)
+    plans = OrderedDict()
+    print("model\tvariables\tbefore(ms)\tafter(ms)\tpredicted\tmeasured")
+    for filename in args.graphs:
+        graph = GraphIR.load(filename)
+        model = graph.meta["model"]
+        oracle = TimeOracle.load(args.time_oracle or oracle_filename(model), graph.meta["scope"])
+        plan, before, after = PartitionPlanner(graph, oracle, link, args.statistic, args.chunks, args.min_gain,
+                                               args.candidates).plan()
+        plans[model] = dict(variables=plan, predicted=dict(before=before, after=after, speedup=before / after),
+                            measured=measured.get(model, []))
+        print("{}\t{}\t{:0.3f}\t{:0.3f}\t{:0.2f}x\t{}".format(
+            model, ", ".join("{}:{}".format(name, chunks) for name, chunks in plan.items()) or "-", before / 1000,
+            after / 1000, before / after,
+            ", ".join("{algorithm}/{stage}: {value:0.2f}x".format(**row) for row in measured.get(model, [])) or "-"))
+    with open(args.output, "w") as fp:
+        json.dump(plans, fp, indent=1)
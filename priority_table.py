@@ -0,0 +1,194 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+"""
+Binary priority table (`rpc_orders.bin`), the priorities of `rpc_orders.h` in a form a server could load at startup
+instead of having them compiled in. OrderedTF has no loader for it yet: reading it at startup (and looking up the
+hash of a name there instead of in `rpc_list`) is still to be written on the OrderedTF side, against this layout.
+
+All integers are little-endian; the file is:
+
+    header    20 bytes  magic b"RPCO", version u16 (1), flags u16 (0), scopes u32, total entries u32,
+                        CRC32 of the payload (everything after the header checksum) u32
+    checksum   4 bytes  CRC32 of the 20 header bytes, u32
+    payload             `scopes` sections, back to back:
+      scope   14 bytes  name length u16, graph fingerprint u64, entries u32
+      name              scope name, UTF-8, `name length` bytes, not terminated
+      entries 12 bytes  each: name hash u64, priority i32; sorted by hash
+
+A name hash is the 64-bit FNV-1a (offset basis 0xcbf29ce484222325, prime 0x100000001b3) of the UTF-8 name as listed
+in `rpc_orders.h` (parameter reads without their "/read" suffix, gradient sends as is). The fingerprint of a scope is
+the hash of the sorted names of its graph joined by newlines, so that a stale table can be detected. Hashes are
+unique over the whole table: collisions are rejected when it is written.
+"""
+import argparse
+import os
+import struct
+import sys
+import zlib
+from collections import OrderedDict
+
+from graph_ir import GraphIR, is_recv_name
+
+__author__ = 'Sayed Hadi Hashemi'
+
+MAGIC = b"RPCO"
+VERSION = 1
+# magic, version, flags, scopes, entries, payload crc32; followed by the crc32 of these bytes.
+HEADER = struct.Struct("<4sHHIII")
+CHECKSUM = struct.Struct("<I")
+# name length, graph fingerprint, entries; followed by the name and the entries.
+SCOPE = struct.Struct("<HQI")
+# name hash, priority; sorted by hash within a scope.
+ENTRY = struct.Struct("<Qi")
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+
+
+def name_hash(name):
+    """64-bit FNV-1a of the UTF-8 name; a loader has to hash the names it looks up the same way."""
+    h = FNV_OFFSET
+    for byte in name.encode():
+        h = ((h ^ byte) * FNV_PRIME) & 0xffffffffffffffff
+    return h
+
+
+def table_name(name):
+    return name[:-5] if is_recv_name(name) else name
+
+
+def graph_names(graph):
+    """Names the priorities of `graph` are looked up by: its parameter reads and gradient sends."""
+    return [graph.recv_name(node) for node in range(len(graph)) if graph.recv[node]] + \
+           [gradient for gradient, _ in graph.meta.get("sends", [])]
+
+
+def graph_fingerprint(graph):
+    return name_hash("\n".join(sorted(set(graph_names(graph)))))
+
+
+class PriorityTable:
+    """
+    Compact binary form of `rpc_orders.h` (layout in the module docstring), meant to be loaded at startup instead of
+    compiled in once OrderedTF has a loader for it. Each model scope has a section with the fingerprint of the graph
+    it was ordered for and its (name hash, priority) entries; the header carries checksums of itself and of the
+    sections.
+    """
+
+    def __init__(self, scopes=None):
+        # {scope: (fingerprint, {name hash: priority})}
+        self.scopes = scopes or OrderedDict()
+
+    @classmethod
+    def from_priorities(cls, priorities_dict, fingerprints=None):
+        """`priorities_dict` is {scope: [(priority, name)]} as given to `priority_print`."""
+        fingerprints = fingerprints or {}
+        names = {}
+        table = cls()
+        for scope, priorities in priorities_dict.items():
+            entries = {}
+            for priority, name in priorities:
+                name = table_name(name)
+                h = name_hash(name)
+                if names.setdefault(h, name) != name:
+                    raise ValueError("Name hash collision: {} and {}".format(names[h], name))
+                if h in entries:
+                    raise ValueError("{}: more than one priority for {}".format(scope, name))
+                entries[h] = priority
+            table.scopes[scope] = (fingerprints.get(scope, 0), entries)
+        return table
+
+    def priority(self, name):
+        h = name_hash(table_name(name))
+        for _, entries in self.scopes.values():
+            if h in entries:
+                return entries[h]
+        return None
+
+    def dumps(self):
+        payload = b""
+        for scope, (fingerprint, entries) in self.scopes.items():
+            scope_name = scope.encode()
+            payload += SCOPE.pack(len(scope_name), fingerprint, len(entries)) + scope_name
+            payload += b"".join(ENTRY.pack(h, entries[h]) for h in sorted(entries))
+        header = HEADER.pack(MAGIC, VERSION, 0, len(self.scopes), sum(len(e) for _, e in self.scopes.values()),
+                             zlib.crc32(payload))
+        return header + CHECKSUM.pack(zlib.crc32(header)) + payload
+
+    def save(self, filename):
+        # Written aside and renamed, so that a loader never sees a partial table.
+        with open(filename + ".tmp", "wb") as fp:
+            fp.write(self.dumps())
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def loads(cls, data):
+        if len(data) < HEADER.size + CHECKSUM.size:
+            raise ValueError("Truncated priority table")
+        header = data[:HEADER.size]
+        magic, version, _, scopes, total, payload_crc = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("Not a priority table")
+        if CHECKSUM.unpack_from(data, HEADER.size)[0] != zlib.crc32(header):
+            raise ValueError("Priority table header checksum mismatch")
+        if version != VERSION:
+            raise ValueError("Unsupported priority table version: {}".format(version))
+        offset = HEADER.size + CHECKSUM.size
+        if zlib.crc32(data[offset:]) != payload_crc:
+            raise ValueError("Priority table checksum mismatch")
+
+        table = cls()
+        for _ in range(scopes):
+            name_length, fingerprint, count = SCOPE.unpack_from(data, offset)
+            offset += SCOPE.size
+            scope = data[offset:offset + name_length].decode()
+            offset += name_length
+            table.scopes[scope] = (fingerprint, dict(ENTRY.iter_unpack(
+                data[offset:offset + count * ENTRY.size])))
+            offset += count * ENTRY.size
+        if offset != len(data) or sum(len(e) for _, e in table.scopes.values()) != total:
+            raise ValueError("Corrupted priority table")
+        return table
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as fp:
+            return cls.loads(fp.read())
+
+    def validate(self, graph):
+        """Problems of this table for `graph` (empty if the table is up to date with it)."""
+        scope = graph.meta.get("scope")
+        if scope not in self.scopes:
+            return ["{}: not in the table".format(scope)]
+        fingerprint, entries = self.scopes[scope]
+        problems = []
+        if fingerprint != graph_fingerprint(graph):
+            problems.append("{}: ordered for another graph (stale table)".format(scope))
+        names = graph_names(graph)
+        missing = [name for name in names if name_hash(name) not in entries]
+        if missing:
+            problems.append("{}: {} of {} names have no priority: {}{}".format(
+                scope, len(missing), len(names), ", ".join(missing[:5]), ", ..." if len(missing) > 5 else ""))
+        unknown = len(set(entries) - set(map(name_hash, names)))
+        if unknown:
+            problems.append("{}: {} priorities of names not in the graph".format(scope, unknown))
+        return problems
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Checks a binary priority table against the exported graphs.")
+    parser.add_argument("table", help="Priority table e.g. rpc_orders.bin")
+    parser.add_argument("graphs", help="Graphs exported by 0_extract_orders.py e.g. graph-vgg16-TAO.json.gz",
+                        nargs="*")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    table = PriorityTable.load(args.table)
+    for scope, (fingerprint, entries) in table.scopes.items():
+        print("//{}\tentries: {}\tgraph: {:016x}".format(scope, len(entries), fingerprint))
+    problems = [problem for filename in args.graphs for problem in table.validate(GraphIR.load(filename))]
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,146 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import json
+
+import numpy as np
+
+from results import ResultAnalyser
+from trace_store import load_result, untraced_times
+
+__author__ = 'Sayed Hadi Hashemi'
+
+BASELINE_ALGORITHM = "none"
+
+
+def bootstrap_ratio(numerator, denominator, resamples=2000, alpha=0.05, seed=0):
+    """
+    median(numerator) / median(denominator) and its percentile bootstrap confidence interval. Medians keep single
+    slow steps from widening the interval.
+    """
+    rng = np.random.RandomState(seed)
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    ratios = (np.median(numerator[rng.randint(0, len(numerator), (resamples, len(numerator)))], axis=1) /
+              np.median(denominator[rng.randint(0, len(denominator), (resamples, len(denominator)))], axis=1))
+    lower, upper = np.percentile(ratios, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return float(np.median(numerator) / np.median(denominator)), float(lower), float(upper)
+
+
+def outliers(times):
+    """Indices of the steps outside Tukey's fences (1.5 IQR beyond the quartiles)."""
+    q1, q3 = np.percentile(times, [25, 75])
+    fence = 1.5 * (q3 - q1)
+    return [int(i) for i in np.flatnonzero((times < q1 - fence) | (times > q3 + fence))]
+
+
+def stragglers(analyser, threshold=0.2):
+    """Workers whose median makespan is more than `threshold` above the median over all workers."""
+    if not analyser.effs:
+        return []
+    makespans = np.median([[e.U for e in step] for step in analyser.effs], axis=0)
+    typical = np.median(makespans)
+    return [device for device, makespan in zip(analyser.worker_devices, makespans)
+            if makespan > typical * (1 + threshold)]
+
+
+def summarize(result):
+    times = np.array(untraced_times(result), dtype=np.float64)
+    analyser = ResultAnalyser(result)
+    E = [e.E for e in analyser.all_effs if e.E != -1]
+    S = [e.S for e in analyser.all_effs if e.S != -1]
+    return dict(model=result.base_model, algorithm=result.ordering_algorithm, stage=result.stage,
+                workers=result.workers, ps_tasks=getattr(result, "ps_tasks", None) or 1,
+                partitioned=bool(getattr(result, "partition_plan", None)), steps=len(times), times=times.tolist(),
+                mean=float(times.mean()), median=float(np.median(times)), std=float(times.std()),
+                p5=float(np.percentile(times, 5)), p95=float(np.percentile(times, 95)),
+                outliers=outliers(times), stragglers=stragglers(analyser),
+                E=float(np.mean(E)) if E else None, S=float(np.mean(S)) if S else None)
+
+
+def cluster_key(row):
+    """Model, stage and cluster setup of a row; rows of reports without PS tasks or partitioning ran with 1 and none."""
+    return row["model"], row["stage"], row["workers"], row.get("ps_tasks", 1), row.get("partitioned", False)
+
+
+def config_key(row):
+    model, stage, workers, ps_tasks, partitioned = cluster_key(row)
+    return "{}-{}-{}-{}-{}ps{}".format(model, row["algorithm"], stage, workers, ps_tasks,
+                                       "-partitioned" if partitioned else "")
+
+
+def add_speedups(rows, resamples, alpha, seed):
+    """
+    Speedup of every ordering over `none` of the same model, stage, workers, PS tasks and partitioning (> 1 is
+    faster).
+    """
+    baselines = {cluster_key(row): row for row in rows if row["algorithm"] == BASELINE_ALGORITHM}
+    for row in rows:
+        baseline = baselines.get(cluster_key(row))
+        if baseline is None or row is baseline:
+            row["speedup"] = None
+            continue
+        speedup, lower, upper = bootstrap_ratio(baseline["times"], row["times"], resamples, alpha, seed)
+        row["speedup"] = dict(value=speedup, lower=lower, upper=upper, significant=lower > 1 or upper < 1)
+
+
+def compare(baseline_rows, rows, resamples, alpha, seed):
+    """Configurations whose iteration time got significantly worse than in `baseline_rows`."""
+    baseline = {config_key(row): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        old = baseline.get(config_key(row))
+        if old is None:
+            continue
+        ratio, lower, upper = bootstrap_ratio(row["times"], old["times"], resamples, alpha, seed)
+        row["change"] = dict(value=ratio, lower=lower, upper=upper)
+        if lower > 1:
+            regressions.append(config_key(row))
+    return regressions
+
+
+def format_table(rows):
+    lines = ["model\tworkers\tps\tpartitioned\tstage\talgorithm\tsteps\tmedian(ms)\tp95(ms)\tspeedup [CI]\tE\tS\t"
+             "outliers\tstragglers"]
+    for row in rows:
+        speedup = "-"
+        if row["speedup"]:
+            speedup = "{value:0.3f} [{lower:0.3f}, {upper:0.3f}]{star}".format(
+                star="*" if row["speedup"]["significant"] else "", **row["speedup"])
+        lines.append("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{:0.1f}\t{:0.1f}\t{}\t{}\t{}\t{}\t{}".format(
+            row["model"], row["workers"], row["ps_tasks"], "yes" if row["partitioned"] else "no", row["stage"],
+            row["algorithm"], row["steps"], row["median"] * 1000, row["p95"] * 1000, speedup,
+            "-" if row["E"] is None else "{:0.2f}".format(row["E"]),
+            "-" if row["S"] is None else "{:0.2f}".format(row["S"]), len(row["outliers"]), len(row["stragglers"])))
+    return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Statistical report of experiment results.")
+    parser.add_argument("results", help="Results of 1_run_experiments.py e.g. *.trace", nargs="+")
+    parser.add_argument("-o", "--output", help="JSON report", default="report.json")
+    parser.add_argument("-c", "--compare", help="JSON report of a previous run to check for regressions")
+    parser.add_argument("-b", "--bootstrap", help="Number of bootstrap resamples", type=int, default=2000)
+    parser.add_argument("-a", "--alpha", help="Significance level of the confidence intervals", type=float,
+                        default=0.05)
+    parser.add_argument("--seed", help="Seed of the bootstrap", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rows = sorted((summarize(load_result(filename)) for filename in args.results),
+                  key=lambda row: (row["model"], row["workers"], row["ps_tasks"], row["partitioned"], row["stage"],
+                                   row["algorithm"] != "none", row["algorithm"]))
+    add_speedups(rows, args.bootstrap, args.alpha, args.seed)
+    report = dict(alpha=args.alpha, configurations=rows)
+    print(format_table(rows))
+
+    if args.compare:
+        with open(args.compare, "r") as fp:
+            baseline_rows = json.load(fp)["configurations"]
+        report["regressions"] = compare(baseline_rows, rows, args.bootstrap, args.alpha, args.seed)
+        print("Regressions: {}".format(", ".join(report["regressions"]) or "none"))
+
+    with open(args.output, "w") as fp:
+        json.dump(report, fp, indent=1)
@@ -2,11 +2,87 @@
 # coding=utf-8
 import numpy as np
 
+from trace_store import to_ops
 from utils import Efficiency
 
 __author__ = 'Sayed Hadi Hashemi'
 
 
+class BatchEfficiency:
+    """
+    `Efficiency` of every (step, device) of a columnar trace at once. Ops are grouped into comm/comp segments per
+    (step, device), sorted by start, and the utilization of each segment is the length of the union of its
+    intervals, computed with one running maximum over all segments.
+
+    All arrays are indexed `[step, device]`, where steps are `np.unique(ops["step"])` and devices are the device ids.
+    """
+
+    def __init__(self, ops, num_devices):
+        self.steps, step_index = np.unique(ops["step"], return_inverse=True)
+        shape = (len(self.steps), num_devices, 2)
+        segment = (step_index.astype(np.int64) * num_devices + ops["device"]) * 2 + ops["is_recv"]
+        start = ops["start"].astype(np.int64)
+        end = start + ops["op_end"]
+
+        order = np.lexsort((start, segment))
+        segment, start, end = segment[order], start[order], end[order]
+        size = np.prod(shape)
+        first = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]]) if len(segment) else np.zeros(0, np.int64)
+        present = segment[first]
+
+        seg_start = np.zeros(size, dtype=np.int64)
+        seg_end = np.zeros(size, dtype=np.int64)
+        utilization = np.zeros(size, dtype=np.int64)
+        if len(segment):
+            seg_start[present] = start[first]
+            seg_end[present] = np.maximum(0, np.maximum.reduceat(end, first))
+            # Shift every segment into its own disjoint range, so that one running max never crosses segments.
+            base = seg_start[segment]
+            span = (end - base).max() + 1
+            shifted_start = start - base + segment * span
+            shifted_end = end - base + segment * span
+            covered = np.maximum.accumulate(shifted_end)
+            previous = np.r_[-1, covered[:-1]]
+            gain = np.maximum(0, shifted_end - np.maximum(previous, shifted_start))
+            utilization[present] = np.add.reduceat(gain, first)
+
+        seg_start, seg_end, utilization = (a.reshape(shape) for a in (seg_start, seg_end, utilization))
+        self.M = utilization[..., 1]
+        self.P = utilization[..., 0]
+        self.U = np.maximum(seg_end[..., 1], seg_end[..., 0]) - seg_start[..., 0]
+        self.cost_max = self.M + self.P
+        self.cost_min = np.maximum(self.M, self.P)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.E = np.where(self.cost_max != self.cost_min,
+                              (self.cost_max - self.U) / (self.cost_max - self.cost_min), -1)
+            self.S = np.where(self.cost_min != 0, (self.cost_max - self.cost_min) / self.cost_min, -1)
+            self.a = np.where(self.P != 0, self.M / self.P, -1)
+
+    def efficiency(self, step, device):
+        return Efficiency.from_values(int(self.M[step, device]), int(self.P[step, device]),
+                                      int(self.U[step, device]))
+
+
+def device_groups(ops, devices, groups):
+    """
+    Rows of `ops` relabelled with the index of their group, as `Efficiency(device_search=group)` selects them: a group
+    takes the ops of every device whose name contains it (`.../device:GPU:0` also takes `.../device:GPU:0/stream:all`
+    and the other streams), so an op is repeated once per group it falls in.
+    """
+    pairs = sorted((device, group) for group, search in enumerate(groups) for device, name in enumerate(devices)
+                   if search in name)
+    pair_device = np.array([device for device, _ in pairs], dtype=np.int64)
+    pair_group = np.array([group for _, group in pairs], dtype=np.int64)
+    counts = np.bincount(pair_device, minlength=len(devices))
+    first_pair = np.cumsum(counts) - counts
+    repeats = counts[ops["device"]]
+    rows = np.repeat(np.arange(len(ops)), repeats)
+    position = np.arange(len(rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    grouped = ops[rows]
+    grouped["device"] = pair_group[first_pair[grouped["device"]] + position]
+    return grouped
+
+
 class ResultAnalyser:
     def __init__(self, experiment_result):
         self.effs = []
@@ -18,11 +94,17 @@ class ResultAnalyser:
     def _update(self, experiment_result):
         if len(experiment_result.metadata) == 0:
             return
-        self.worker_devices = \
-            list(set([a.device for a in experiment_result.metadata[-1].step_stats.dev_stats if "worker" in a.device]))
+        if hasattr(experiment_result, "ops"):
+            ops, devices = experiment_result.ops, experiment_result.devices
+        else:
+            ops, _, devices, _ = to_ops(experiment_result.metadata)
+        last_step = ops["step"].max()
+        device_ids = sorted(set(ops["device"][ops["step"] == last_step]))
+        self.worker_devices = [devices[d] for d in device_ids if "worker" in devices[d]]
 
-        for m in experiment_result.metadata:
-            effs_ = [Efficiency(m, device_search=d) for d in self.worker_devices]
+        batch = BatchEfficiency(device_groups(ops, devices, self.worker_devices), len(self.worker_devices))
+        for step in range(len(batch.steps)):
+            effs_ = [batch.efficiency(step, g) for g in range(len(self.worker_devices))]
             self.effs.append(effs_)
             self.all_effs += effs_
 
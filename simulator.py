@@ -0,0 +1,177 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import heapq
+import random
+from collections import namedtuple
+
+from graph_ir import GraphIR
+from oracle import TimeOracle, parse_statistic
+from order_graphs import oracle_filename
+from trace_store import DeviceStats, NodeStats, StepMetadata, StepStats
+from utils import Efficiency
+from wizard import TAO, TIO, TimedOrdering
+
+__author__ = 'Sayed Hadi Hashemi'
+
+WORKER_DEVICE = "/job:worker/replica:0/task:0/device:CPU:0"
+PS_DEVICE = "/job:ps/replica:0/task:{}/device:CPU:0"
+
+Simulation = namedtuple("Simulation", ["makespan", "efficiency", "metadata"])
+
+
+class Link:
+    """
+    PS->worker channel shared by `workers` workers. `bandwidth` is in bytes/s and `latency` in microseconds. Without
+    a bandwidth (or for tensors of unknown size) the transfer time measured by the time oracle is used instead.
+    """
+
+    def __init__(self, bandwidth=None, latency=0, workers=1):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.workers = workers
+
+    def transfer_time(self, size, measured):
+        if self.bandwidth and size:
+            return self.latency + size * self.workers / self.bandwidth * 1e6
+        return self.latency + measured
+
+
+class Simulator(TimedOrdering):
+    """
+    Predicts one iteration of a worker under a given recv ordering. Transfers run one at a time per PS channel (each
+    one a `link`) in priority order; comp ops run one at a time on the worker, each as soon as its inputs are
+    available (ready ops are started in the order they became ready).
+    """
+
+    def __init__(self, target_node, time_oracle, link=None, statistic="min"):
+        super().__init__(target_node, time_oracle, statistic)
+        self._link = link or Link()
+        self._build_ops()
+
+    def _build_ops(self):
+        recv_index = {op: r for r, op in enumerate(self._comm_ops)}
+        index = {}
+        self._op_names = []
+        self._op_times = []
+        self._op_inputs = []
+        self._op_recvs = []
+        for op in sorted(self._comp_ops):
+            name = self._graph.op_name(op)
+            if name not in index:
+                index[name] = len(self._op_names)
+                self._op_names.append(name)
+                self._op_times.append(self._get_time(op))
+                self._op_inputs.append(set())
+                self._op_recvs.append(set())
+        for op in self._comp_ops:
+            o = index[self._graph.op_name(op)]
+            for input_op in self._graph.inputs[op]:
+                if input_op in recv_index:
+                    self._op_recvs[o].add(recv_index[input_op])
+                elif index[self._graph.op_name(input_op)] != o:
+                    self._op_inputs[o].add(index[self._graph.op_name(input_op)])
+        self._successors = [[] for _ in self._op_names]
+        for o, inputs in enumerate(self._op_inputs):
+            for i in inputs:
+                self._successors[i].append(o)
+        self._recv_names = [self._graph.op_name(op) for op in self._comm_ops]
+        self._recv_times = [self._link.transfer_time(self._graph.sizes[op], self._get_time(op))
+                            for op in self._comm_ops]
+
+    def _comm_order(self, priorities):
+        if priorities is None:
+            return list(range(len(self._comm_ops)))
+        rank = {name: counter for counter, name in priorities}
+        # Recv ops missing from the ordering are sent last, in graph order.
+        return sorted(range(len(self._comm_ops)), key=lambda r: rank.get(self._recv_names[r], float("inf")))
+
+    def _simulate_comm(self, order):
+        start = [0] * len(order)
+        end = [0] * len(order)
+        now = {}
+        for r in order:
+            channel = self._channels[r]
+            start[r] = now.get(channel, 0)
+            now[channel] = end[r] = start[r] + self._recv_times[r]
+        return start, end
+
+    def _simulate_comp(self, recv_end):
+        remaining = [len(inputs) for inputs in self._op_inputs]
+        ready = [max((recv_end[r] for r in recvs), default=0) for recvs in self._op_recvs]
+        heap = [(ready[o], o) for o in range(len(self._op_names)) if not remaining[o]]
+        heapq.heapify(heap)
+        start = [0] * len(self._op_names)
+        end = [0] * len(self._op_names)
+        now = 0
+        while heap:
+            ready_time, o = heapq.heappop(heap)
+            start[o] = max(now, ready_time)
+            now = end[o] = start[o] + self._op_times[o]
+            for s in self._successors[o]:
+                ready[s] = max(ready[s], now)
+                remaining[s] -= 1
+                if not remaining[s]:
+                    heapq.heappush(heap, (ready[s], s))
+        return start, end
+
+    def simulate(self, priorities=None):
+        """`priorities` as returned by `get_priorities()` of an ordering; `None` sends in graph order."""
+        recv_start, recv_end = self._simulate_comm(self._comm_order(priorities))
+        comp_start, comp_end = self._simulate_comp(recv_end)
+
+        recvs = zip(self._recv_names, recv_start, recv_end, self._channels)
+        node_stats = [NodeStats("RecvTensor", start, end - start, end - start,
+                                "edge_{}_{} from {}".format(r, name, PS_DEVICE.format(channel)))
+                      for r, (name, start, end, channel) in enumerate(recvs)]
+        node_stats += [NodeStats(name, start, end - start, end - start, "")
+                       for name, start, end in zip(self._op_names, comp_start, comp_end)]
+        node_stats.sort(key=lambda op: op.all_start_micros)
+        dev_stats = [DeviceStats(WORKER_DEVICE, node_stats)]
+        dev_stats += [DeviceStats(PS_DEVICE.format(channel), []) for channel in sorted(set(self._channels))]
+        metadata = StepMetadata(StepStats(dev_stats))
+        makespan = max(recv_end + comp_end, default=0)
+        return Simulation(makespan, Efficiency(metadata), metadata)
+
+
+def candidate_orderings(graph, time_oracle, statistic="min", seed=0):
+    orderings = dict(none=None,
+                     TAO=TAO(graph, time_oracle, statistic).get_priorities(),
+                     TIO=TIO(graph).get_priorities())
+    names = [name for _, name in orderings["TIO"]]
+    random.Random(seed).shuffle(names)
+    orderings["random"] = list(enumerate(names))
+    return orderings
+
+
+def rank_orderings(graph, time_oracle, link=None, statistic="min", seed=0):
+    """Simulates the none/TAO/TIO/random orderings of `graph`; returns (name, Simulation) pairs, fastest first."""
+    simulator = Simulator(graph, time_oracle, link, statistic)
+    results = [(name, simulator.simulate(priorities))
+               for name, priorities in candidate_orderings(graph, time_oracle, statistic, seed).items()]
+    return sorted(results, key=lambda row: row[1].makespan)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Predicts the iteration time of orderings by simulation.")
+    parser.add_argument("graph", help="Graph exported by 0_extract_orders.py e.g. graph-vgg16-TAO.json.gz")
+    parser.add_argument("-t", "--time-oracle", help="Time oracle (default: time-oracle-{model}.json)")
+    parser.add_argument("-b", "--bandwidth", help="PS->worker bandwidth in Gbit/s (default: oracle transfer times)",
+                        type=float)
+    parser.add_argument("-l", "--latency", help="Per-transfer latency in microseconds", type=float, default=0)
+    parser.add_argument("-w", "--workers", help="Number of workers sharing the PS link", type=int, default=1)
+    parser.add_argument("-s", "--statistic", help="Op durations: min, mean, max or a quantile e.g. 0.9",
+                        type=parse_statistic, default="min")
+    parser.add_argument("--seed", help="Seed of the random ordering", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    graph = GraphIR.load(args.graph)
+    oracle = TimeOracle.load(args.time_oracle or oracle_filename(graph.meta["model"]), graph.meta["scope"])
+    link = Link(args.bandwidth * 1e9 / 8 if args.bandwidth else None, args.latency, args.workers)
+    print("ordering\tmakespan(ms)\tE\tS\ta")
+    for name, result in rank_orderings(graph, oracle, link, args.statistic, args.seed):
+        print("{}\t{:0.3f}\t{:0.2f}\t{:0.2f}\t{:0.2f}".format(
+            name, result.makespan / 1000, result.efficiency.E, result.efficiency.S, result.efficiency.a))
@@ -0,0 +1,202 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import bisect
+import json
+
+from chrome_trace import load_header_priorities, transfer_name
+from graph_ir import GraphIR
+from oracle import TimeOracle
+from trace_store import load_result
+from wizard import BaseOrdering, iter_bits
+
+__author__ = 'Sayed Hadi Hashemi'
+
+
+def deviation(rank, lower, upper):
+    """Distance of an observed arrival rank from the ranks [lower, upper] its priority allows (0 if inside)."""
+    return rank - upper if rank > upper else rank - lower if rank < lower else 0
+
+
+class StallAnalysis(BaseOrdering):
+    """
+    Attributes the idle compute time of every worker and step of a trace to the recv ops of `graph`.
+
+    Comp ops of a worker are replayed in start order. An idle gap before a comp op (including the gap between the
+    start of the step and the first comp op) is blamed on the dependency (`self._deps`) of that op which arrived last
+    inside the gap; gaps that no dependency explains (scheduling, comp ops missing from `graph`) are unattributed.
+
+    The measured critical path of a step is walked back from the comp op that finished last, always to the input
+    that finished last, until it reaches an op without traced inputs; it is rooted at a recv op if the step was
+    bound by a transfer.
+    """
+
+    def __init__(self, graph, scope=None):
+        super().__init__(graph)
+        remove_prefix = TimeOracle(self._graph.meta.get("scope", "")).remove_prefix
+        self._trace_prefix = TimeOracle(scope).remove_prefix if scope else remove_prefix
+        self.recv_names = [remove_prefix(self._graph.op_name(op)) for op in self._comm_ops]
+        self._recv_index = {name: r for r, name in enumerate(self.recv_names)}
+        self._op_deps = {}
+        for op, op_deps in zip(self._comp_ops, self._deps):
+            name = remove_prefix(self._graph.op_name(op))
+            self._op_deps[name] = self._op_deps.get(name, 0) | op_deps
+        self._op_inputs = {}
+        for op in self._comp_ops:
+            inputs = self._op_inputs.setdefault(remove_prefix(self._graph.op_name(op)), set())
+            inputs.update(remove_prefix(self._graph.op_name(input_op)) for input_op in self._graph.inputs[op])
+
+        self.steps = 0
+        self.idle = 0
+        self.unattributed = 0
+        self.stalls = [0] * len(self._comm_ops)
+        self.stalled_steps = [0] * len(self._comm_ops)
+        self.critical_roots = [0] * len(self._comm_ops)
+        self.deviations = [[] for _ in self._comm_ops]
+
+    def recv_priorities(self, priorities):
+        """Priority of each recv op from {name: priority} as read by `load_header_priorities`."""
+        return [priorities.get(self._graph.recv_name(op)) for op in self._comm_ops]
+
+    def _worker_step(self, node_stats):
+        arrivals = {}
+        comp = []
+        for op in node_stats:
+            end = op.all_start_micros + op.all_end_rel_micros
+            if op.node_name == "RecvTensor":
+                r = self._recv_index.get(self._trace_prefix(transfer_name(op)))
+                if r is not None:
+                    arrivals[r] = max(arrivals.get(r, end), end)
+            else:
+                comp.append((op.all_start_micros, end, self._trace_prefix(op.node_name)))
+        if not comp:
+            return None
+        comp.sort()
+
+        stalls = {}
+        busy_until = min(op.all_start_micros for op in node_stats)
+        for start, end, name in comp:
+            if start > busy_until:
+                self.idle += start - busy_until
+                arrived = [(arrivals[r], r) for r in iter_bits(self._op_deps.get(name, 0))
+                           if r in arrivals and busy_until < arrivals[r] <= start]
+                if arrived:
+                    r = max(arrived)[1]
+                    stalls[r] = stalls.get(r, 0) + start - busy_until
+                else:
+                    self.unattributed += start - busy_until
+            busy_until = max(busy_until, end)
+        return arrivals, comp, stalls
+
+    def _critical_path(self, arrivals, comp):
+        ends = {name: end for _, end, name in comp}
+        ends.update((self.recv_names[r], end) for r, end in arrivals.items())
+        name = max(comp, key=lambda op: op[1])[2]
+        path = [name]
+        visited = {name}
+        while name in self._op_inputs:
+            inputs = [input_name for input_name in self._op_inputs[name]
+                      if input_name in ends and input_name not in visited]
+            if not inputs:
+                break
+            name = max(inputs, key=ends.get)
+            path.append(name)
+            visited.add(name)
+        return path[::-1]
+
+    def _add_deviations(self, arrivals, priorities):
+        # Priorities are counted per PS channel, so arrivals are ranked against the other arrivals of their channel.
+        channels = {}
+        for r in sorted((r for r in arrivals if priorities[r] is not None), key=arrivals.get):
+            channels.setdefault(self._channels[r], []).append(r)
+        for ranked in channels.values():
+            observed = sorted(priorities[r] for r in ranked)
+            for rank, r in enumerate(ranked):
+                lower = bisect.bisect_left(observed, priorities[r])
+                upper = bisect.bisect_right(observed, priorities[r]) - 1
+                self.deviations[r].append(deviation(rank, lower, upper))
+
+    def add_step(self, metadata, priorities=None):
+        """Adds one traced step; `priorities` are the `recv_priorities` the step was ordered with."""
+        paths = []
+        for device in metadata.step_stats.dev_stats:
+            if "worker" not in device.device:
+                continue
+            worker_step = self._worker_step(device.node_stats)
+            if worker_step is None:
+                continue
+            arrivals, comp, stalls = worker_step
+            for r, stall in stalls.items():
+                self.stalls[r] += stall
+                self.stalled_steps[r] += 1
+
+            path = self._critical_path(arrivals, comp)
+            if path[0] in self._recv_index:
+                self.critical_roots[self._recv_index[path[0]]] += 1
+            paths.append((device.device, path))
+
+            if priorities:
+                self._add_deviations(arrivals, priorities)
+        self.steps += 1
+        return paths
+
+    def offenders(self, priorities=None):
+        """Recv ops that stalled computation, worst first."""
+        rows = []
+        for r, name in enumerate(self.recv_names):
+            if not self.stalls[r] and not self.critical_roots[r]:
+                continue
+            deviations = self.deviations[r]
+            rows.append(dict(name=name, stall=self.stalls[r], stalled_steps=self.stalled_steps[r],
+                             mean_stall=self.stalls[r] / self.steps, critical=self.critical_roots[r],
+                             priority=priorities[r] if priorities else None,
+                             deviation=sum(deviations) / len(deviations) if deviations else None,
+                             abs_deviation=sum(map(abs, deviations)) / len(deviations) if deviations else None))
+        return sorted(rows, key=lambda row: (-row["stall"], -row["critical"], row["name"]))
+
+
+def format_offenders(rows, top):
+    lines = ["recv op\tstall(ms)\tper step(ms)\tstalled steps\tcritical\tpriority\tdeviation\t|deviation|"]
+    for row in rows[:top]:
+        lines.append("{}\t{:0.2f}\t{:0.3f}\t{}\t{}\t{}\t{}\t{}".format(
+            row["name"], row["stall"] / 1000, row["mean_stall"] / 1000, row["stalled_steps"], row["critical"],
+            "-" if row["priority"] is None else row["priority"],
+            "-" if row["deviation"] is None else "{:0.1f}".format(row["deviation"]),
+            "-" if row["abs_deviation"] is None else "{:0.1f}".format(row["abs_deviation"])))
+    return "\n".join(lines)
+
+
+def analyse(result, graph, priorities=None, steps=None):
+    analysis = StallAnalysis(graph, "{}-{}".format(result.base_model, result.ordering_algorithm))
+    recv_priorities = analysis.recv_priorities(priorities) if priorities else None
+    paths = []
+    for i, metadata in enumerate(result.metadata):
+        if steps is not None and i >= steps:
+            break
+        paths.append(analysis.add_step(metadata, recv_priorities))
+    return analysis, analysis.offenders(recv_priorities), paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Attributes the compute stalls of experiment results to recv ops.")
+    parser.add_argument("result", help="Result of 1_run_experiments.py e.g. vgg16-TAO-fw-4.trace")
+    parser.add_argument("graph", help="Graph exported by 0_extract_orders.py e.g. graph-vgg16-TAO.json.gz")
+    parser.add_argument("-p", "--priorities", help="rpc_orders.h the result was run with, to report how far the "
+                                                   "arrival order deviates from the priorities")
+    parser.add_argument("-n", "--top", help="Number of recv ops to show", type=int, default=20)
+    parser.add_argument("-s", "--steps", help="Analyse only the first N steps", type=int, default=None)
+    parser.add_argument("-o", "--output", help="JSON report with all recv ops and the critical path of every step")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    priorities = load_header_priorities(args.priorities) if args.priorities else None
+    analysis, rows, paths = analyse(load_result(args.result), GraphIR.load(args.graph), priorities, args.steps)
+    print("steps: {}\tidle: {:0.1f}ms\tunattributed: {:0.1f}ms".format(
+        analysis.steps, analysis.idle / 1000, analysis.unattributed / 1000))
+    print(format_offenders(rows, args.top))
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(dict(steps=analysis.steps, idle=analysis.idle, unattributed=analysis.unattributed,
+                           offenders=rows, critical_paths=paths), fp, indent=1)
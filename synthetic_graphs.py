@@ -0,0 +1,183 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import math
+import random
+import zlib
+
+from graph_ir import GraphIR
+
+__author__ = 'Sayed Hadi Hashemi'
+
+PS_DEVICE = "/job:ps/task:{}"
+
+
+def _constant(rnd, mean):
+    return mean
+
+
+def _uniform(rnd, mean):
+    return rnd.randint(1, 2 * mean - 1) if mean > 1 else mean
+
+
+def _lognormal(rnd, mean, sigma=1.5):
+    return max(1, int(rnd.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)))
+
+
+def _pareto(rnd, mean, alpha=1.5):
+    return max(1, int(rnd.paretovariate(alpha) * mean * (alpha - 1) / alpha))
+
+
+SIZE_DISTRIBUTIONS = dict(constant=_constant, uniform=_uniform, lognormal=_lognormal, pareto=_pareto)
+
+
+class RandomOracle:
+    """
+    Stand-in time oracle for the benchmarks: an op takes a duration drawn from `comp` (microseconds, inclusive), or
+    from `comm` if given and its name starts with `comm_prefix`. Durations are seeded by the op name, so they do not
+    depend on the order of the queries.
+    """
+
+    def __init__(self, seed=0, comp=(1, 100), comm=None, comm_prefix="v"):
+        self._seed = seed
+        self._comp = comp
+        self._comm = comm
+        self._comm_prefix = comm_prefix
+
+    def query(self, name, statistic="min"):
+        low, high = self._comm if self._comm and name.startswith(self._comm_prefix) else self._comp
+        return random.Random(zlib.crc32(name.encode()) ^ self._seed).randint(low, high)
+
+
+class GraphBuilder:
+    """Collects the nodes of a `GraphIR`; parameter reads are sharded round-robin over `ps_tasks` PS tasks."""
+
+    def __init__(self, scope="synthetic", ps_tasks=1, seed=0, size_distribution="lognormal", mean_size=2 ** 16):
+        self.scope = scope
+        self.ps_tasks = ps_tasks
+        self.rnd = random.Random(seed)
+        self._size = SIZE_DISTRIBUTIONS[size_distribution]
+        self._mean_size = mean_size
+        self.names, self.inputs, self.recv, self.sizes, self.devices = [], [], [], [], []
+        self.reads = []
+
+    def _add(self, name, inputs, recv, size, device):
+        self.names.append("{}/{}:0".format(self.scope, name))
+        self.inputs.append(tuple(inputs))
+        self.recv.append(recv)
+        self.sizes.append(size)
+        self.devices.append(device)
+        return len(self.names) - 1
+
+    def read(self, name, size=None):
+        """A parameter read of `size` bytes (drawn from the size distribution if not given)."""
+        size = self._size(self.rnd, self._mean_size) if size is None else size
+        node = self._add(name + "/read", (), True, size, PS_DEVICE.format(len(self.reads) % self.ps_tasks))
+        self.reads.append(node)
+        return node
+
+    def op(self, name, inputs, size=0):
+        return self._add(name, inputs, False, size, "")
+
+    def build(self, target, **meta):
+        meta = dict(model=self.scope, scope=self.scope, ps_tasks=self.ps_tasks, **meta)
+        return GraphIR(self.names, self.inputs, self.recv, target, meta, self.sizes, self.devices)
+
+
+def layered_graph(params, depth, fan_in=2, shared=0.0, ps_tasks=1, seed=0, size_distribution="lognormal",
+                  mean_size=2 ** 16, scope="synthetic"):
+    """
+    `params` parameters split over `depth` layers. Every parameter is consumed by one op of its layer that also
+    takes `fan_in` random outputs of the previous layer; each layer ends with a sum of its ops. With probability
+    `shared` an op also reuses a parameter of an earlier layer (tied weights, unrolled recurrences).
+    """
+    builder = GraphBuilder(scope, ps_tasks, seed, size_distribution, mean_size)
+    rnd = builder.rnd
+    previous = [builder.op("input", ())]
+    sums = []
+    for layer in range(depth):
+        earlier = len(builder.reads)
+        ops = []
+        for i in range(params // depth + (layer < params % depth)):
+            name = "layer-{}/param-{}".format(layer, i)
+            inputs = [builder.read(name)] + rnd.sample(previous, min(fan_in, len(previous)))
+            if earlier and rnd.random() < shared:
+                inputs.append(builder.reads[rnd.randrange(earlier)])
+            ops.append(builder.op(name + "/op", inputs))
+        if ops:
+            sums.append(builder.op("layer-{}/sum".format(layer), ops))
+            previous = ops + sums[-1:]
+    return builder.build(builder.op("loss", sums), generator="layered", params=params, depth=depth, fan_in=fan_in,
+                         shared=shared)
+
+
+def transformer_graph(blocks, d_model=512, d_ff=2048, tied_embeddings=True, vocabulary=32000, ps_tasks=1, seed=0,
+                      scope="transformer"):
+    """
+    Transformer-like stack: each block is self-attention (q, k, v and output projections) and a feed-forward layer,
+    both with a residual connection and layer norm. With `tied_embeddings` the embedding is read again by the output
+    logits. Parameter sizes follow `d_model`/`d_ff` (float32).
+    """
+    builder = GraphBuilder(scope, ps_tasks, seed, "constant")
+
+    def dense(name, x, rows, cols):
+        weights = builder.read(name + "/kernel", 4 * rows * cols)
+        bias = builder.read(name + "/bias", 4 * cols)
+        return builder.op(name + "/add", (builder.op(name + "/matmul", (x, weights)), bias))
+
+    def layer_norm(name, x):
+        gamma = builder.read(name + "/gamma", 4 * d_model)
+        beta = builder.read(name + "/beta", 4 * d_model)
+        return builder.op(name + "/add", (builder.op(name + "/mul", (x, gamma)), beta))
+
+    embedding = builder.read("embedding", 4 * vocabulary * d_model)
+    x = builder.op("embedding/lookup", (builder.op("input", ()), embedding))
+    for block in range(blocks):
+        name = "block-{}".format(block)
+        q, k, v = (dense("{}/attention/{}".format(name, p), x, d_model, d_model) for p in "qkv")
+        scores = builder.op(name + "/attention/softmax", (builder.op(name + "/attention/scores", (q, k)),))
+        attention = dense(name + "/attention/output", builder.op(name + "/attention/context", (scores, v)),
+                          d_model, d_model)
+        x = layer_norm(name + "/attention/norm", builder.op(name + "/attention/residual", (x, attention)))
+        hidden = builder.op(name + "/ffn/relu", (dense(name + "/ffn/inner", x, d_model, d_ff),))
+        x = layer_norm(name + "/ffn/norm", builder.op(name + "/ffn/residual", (x, dense(name + "/ffn/outer", hidden,
+                                                                                         d_ff, d_model))))
+    if tied_embeddings:
+        logits = builder.op("logits", (x, embedding))
+    else:
+        logits = builder.op("logits", (x, builder.read("softmax", 4 * vocabulary * d_model)))
+    return builder.build(builder.op("loss", (logits,)), generator="transformer", blocks=blocks)
+
+
+GENERATORS = dict(layered=layered_graph, transformer=transformer_graph)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Exports a synthetic graph, e.g. for order_graphs.py or simulator.py.")
+    parser.add_argument("output", help="Graph file e.g. graph-synthetic-TAO.json.gz")
+    parser.add_argument("-g", "--generator", help="Graph generator", choices=sorted(GENERATORS), default="layered")
+    parser.add_argument("-n", "--params", help="Number of parameters (layered)", type=int, default=1000)
+    parser.add_argument("-d", "--depth", help="Number of layers (layered) or blocks (transformer)", type=int,
+                        default=8)
+    parser.add_argument("-f", "--fan-in", help="Inputs from the previous layer per op (layered)", type=int, default=2)
+    parser.add_argument("--shared", help="Probability an op reuses an earlier parameter (layered)", type=float,
+                        default=0.0)
+    parser.add_argument("--sizes", help="Parameter size distribution (layered)", choices=sorted(SIZE_DISTRIBUTIONS),
+                        default="lognormal")
+    parser.add_argument("-p", "--ps-tasks", help="Number of PS tasks", type=int, default=1)
+    parser.add_argument("-a", "--algorithm", help="Ordering algorithm recorded in the graph", default="TAO")
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    scope = "{}-{}".format(args.generator, args.algorithm)
+    if args.generator == "layered":
+        graph = layered_graph(args.params, args.depth, args.fan_in, args.shared, args.ps_tasks, args.seed, args.sizes,
+                              scope=scope)
+    else:
+        graph = transformer_graph(args.depth, ps_tasks=args.ps_tasks, seed=args.seed, scope=scope)
+    graph.meta.update(model=args.generator, algorithm=args.algorithm)
+    graph.save(args.output)
+    print("{}: {} nodes, {} parameters".format(args.output, len(graph), sum(graph.recv)))
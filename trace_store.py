@@ -0,0 +1,200 @@
+#! /usr/bin/env python -u
+# coding=utf-8
+import argparse
+import json
+import os
+import pickle
+import shutil
+from collections import namedtuple
+
+import numpy as np
+
+__author__ = 'Sayed Hadi Hashemi'
+
+OP_DTYPE = np.dtype([
+    ("step", np.int32),
+    ("device", np.int16),
+    ("name", np.int32),
+    ("start", np.int64),
+    ("op_end", np.int64),
+    ("all_end", np.int64),
+    ("is_recv", np.bool_),
+])
+
+NodeStats = namedtuple("NodeStats", ["node_name", "all_start_micros", "op_end_rel_micros", "all_end_rel_micros",
+                                     "timeline_label"])
+DeviceStats = namedtuple("DeviceStats", ["device", "node_stats"])
+StepStats = namedtuple("StepStats", ["dev_stats"])
+StepMetadata = namedtuple("StepMetadata", ["step_stats"])
+
+
+class _Interner:
+    def __init__(self, values=()):
+        self.values = list(values)
+        self._index = {value: i for i, value in enumerate(self.values)}
+
+    def __call__(self, value):
+        if value not in self._index:
+            self._index[value] = len(self.values)
+            self.values.append(value)
+        return self._index[value]
+
+
+def _step_array(metadata, step, devices, names):
+    rows = []
+    for device in metadata.step_stats.dev_stats:
+        device_id = devices(device.device)
+        for op in device.node_stats:
+            is_recv = op.node_name == "RecvTensor"
+            # Transfers are identified by their timeline label (tensor and source device), ops by their name.
+            name = names(op.timeline_label if is_recv else op.node_name)
+            rows.append((step, device_id, name, op.all_start_micros, op.op_end_rel_micros, op.all_end_rel_micros,
+                         is_recv))
+    return np.array(rows, dtype=OP_DTYPE)
+
+
+def to_ops(metadata):
+    """Columnar `OP_DTYPE` rows of a list of RunMetadata, with the interned device and name tables."""
+    devices = _Interner()
+    names = _Interner()
+    steps = [_step_array(m, step, devices, names) for step, m in enumerate(metadata)]
+    ops = np.concatenate(steps) if steps else np.zeros(0, dtype=OP_DTYPE)
+    offsets = np.cumsum([0] + [len(s) for s in steps], dtype=np.int64)
+    return ops, offsets, devices.values, names.values
+
+
+class _StepSequence:
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return self._store.num_steps
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            return [self[i] for i in range(*step.indices(len(self)))]
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError("step out of range")
+        return self._store.step_metadata(step)
+
+    def __iter__(self):
+        for step in range(len(self)):
+            yield self[step]
+
+
+class TraceStore:
+    """
+    Columnar, memory-mapped replacement of a pickled `ExperimentResult`. All ops of all steps are rows of one
+    structured array (`OP_DTYPE`) sorted by step; names and devices are interned in `meta.json`.
+
+    `metadata` is a lazy sequence of RunMetadata look-alikes (only `step_stats.dev_stats[].node_stats[]` with the
+    fields the analysis uses), so a store can be passed wherever an `ExperimentResult` is expected.
+    """
+
+    def __init__(self, path, ops, offsets, meta):
+        self.path = path
+        self.ops = ops
+        self.offsets = offsets
+        self.names = meta.pop("names")
+        self.devices = meta.pop("devices")
+        self.__dict__.update(meta)
+        self.metadata = _StepSequence(self)
+
+    @property
+    def num_steps(self):
+        return len(self.offsets) - 1
+
+    @staticmethod
+    def write(result, path):
+        ops, offsets, devices, names = to_ops(result.metadata)
+        meta = {key: value for key, value in result.__dict__.items() if key != "metadata"}
+        meta.update(names=names, devices=devices)
+
+        # Written to a temporary directory and swapped in, so `path` is either the old store or the complete new one.
+        tmp = path.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for filename, array in (("ops.npy", ops), ("steps.npy", offsets)):
+            with open(os.path.join(tmp, filename), "wb") as fp:
+                np.save(fp, array)
+        with open(os.path.join(tmp, "meta.json"), "w") as fp:
+            json.dump(meta, fp)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), "r") as fp:
+            meta = json.load(fp)
+        ops = np.load(os.path.join(path, "ops.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(path, "steps.npy"))
+        return cls(path, ops, offsets, meta)
+
+    def rows(self, start=0, stop=None):
+        """Rows of steps [start, stop) as a view of the memory map."""
+        stop = self.num_steps if stop is None else min(stop, self.num_steps)
+        return self.ops[self.offsets[start]:self.offsets[stop]]
+
+    def step_metadata(self, step):
+        rows = self.rows(step, step + 1)
+        dev_stats = []
+        for device_id in np.unique(rows["device"]):
+            device_rows = rows[rows["device"] == device_id]
+            node_stats = [
+                NodeStats("RecvTensor" if is_recv else self.names[name], int(start), int(op_end), int(all_end),
+                          self.names[name] if is_recv else "")
+                for name, start, op_end, all_end, is_recv in zip(
+                    device_rows["name"], device_rows["start"], device_rows["op_end"], device_rows["all_end"],
+                    device_rows["is_recv"])]
+            dev_stats.append(DeviceStats(self.devices[device_id], node_stats))
+        return StepMetadata(StepStats(dev_stats))
+
+
+def trace_path(filename):
+    return os.path.splitext(filename)[0] + ".trace"
+
+
+def load_result(filename):
+    """Loads either a `TraceStore` directory or a pickled `ExperimentResult`."""
+    if os.path.isdir(filename):
+        return TraceStore.load(filename)
+    with open(filename, "rb") as fp:
+        return pickle.load(fp)
+
+
+def untraced_times(result):
+    """Step times of `result` not inflated by FULL_TRACE (all of them if every step was traced)."""
+    traced = set(getattr(result, "traced_steps", range(len(result.times))))
+    times = [t for step, t in enumerate(result.times) if step not in traced]
+    return times or list(result.times)
+
+
+def is_complete(path, **config):
+    """
+    Whether `path` is a readable trace store holding every timed and traced step of its run, and that run was made
+    with `config` (e.g. batch_size, ps_tasks, steps, warmup; a setting the store lacks is None).
+    """
+    try:
+        store = TraceStore.load(path)
+    except (OSError, ValueError, KeyError):
+        return False
+    traced = len(store.traced_steps) if hasattr(store, "traced_steps") else getattr(store, "steps", None)
+    if store.num_steps != traced or len(getattr(store, "times", ())) != getattr(store, "steps", None):
+        return False
+    return all(getattr(store, key, None) == value for key, value in config.items())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Converts pickled ExperimentResults to trace stores.")
+    parser.add_argument("pickles", help="e.g. vgg16-TAO-fw-4.pickle", nargs="+")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for filename in args.pickles:
+        path = trace_path(filename)
+        print("{} -> {}".format(filename, path))
+        TraceStore.write(load_result(filename), path)
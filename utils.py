@@ -2,8 +2,6 @@
 # coding=utf-8
 import time
 
-import tensorflow as tf
-
 __author__ = 'Sayed Hadi Hashemi'
 
 
@@ -25,7 +23,7 @@ def cmp_to_key(mycmp):
 
 class Timer:
     def start_timer(self):
-        self.start = time.time()
+        self.start = time.perf_counter()
 
     def __enter__(self):
         self.start_timer()
@@ -35,7 +33,7 @@ class Timer:
         self.stop_timer()
 
     def stop_timer(self):
-        self.end = time.time()
+        self.end = time.perf_counter()
 
     def elapsed(self):
         return self.end - self.start
@@ -43,6 +41,7 @@ class Timer:
 
 class Timeline:
     def __enter__(self):
+        import tensorflow as tf
         self.run_metadata = tf.RunMetadata()
         self.options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE, output_partition_graphs=True)
         return self
@@ -91,15 +90,26 @@ class Efficiency:
                 self.comm.add_op(op)
             else:
                 self.comp.add_op(op)
-        self.U = max(self.comm._end, self.comp._end) - min(self.comp._start, self.comp._start)
-        self.cost_max = self.comm.utilization() + self.comp.utilization()
-        self.cost_min = max(self.comm.utilization(), self.comp.utilization())
+        self._set(self.comm.utilization(), self.comp.utilization(),
+                  max(self.comm._end, self.comp._end) - min(self.comp._start, self.comp._start))
+
+    @classmethod
+    def from_values(cls, M, P, U):
+        """Efficiency of already computed comm/comp utilizations and makespan (without the trackers)."""
+        eff = cls.__new__(cls)
+        eff._set(M, P, U)
+        return eff
+
+    def _set(self, M, P, U):
+        self.U = U
+        self.cost_max = M + P
+        self.cost_min = max(M, P)
         self.E = (self.cost_max - self.U) / (self.cost_max - self.cost_min) \
             if (self.cost_max - self.cost_min) != 0 else -1
         self.S = (self.cost_max - self.cost_min) / self.cost_min if self.cost_min != 0 else -1
-        self.a = self.comm.utilization() / self.comp.utilization() if self.comp.utilization() != 0 else -1
-        self.P = self.comp.utilization()
-        self.M = self.comm.utilization()
+        self.a = M / P if P != 0 else -1
+        self.P = P
+        self.M = M
 
     def __str__(self):
         return "E: {:0.2f}, S: {:0.2f}, a: {:0.2f} E*S: {:0.2f} M: {:0.0f} P: {:0.0f} U: {:0.0f}".format(
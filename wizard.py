@@ -1,43 +1,69 @@
 #! /usr/bin/env python -u
 # coding=utf-8
 from functools import lru_cache
-import utils
+import collections
+import heapq
+import itertools
 import math
-import tensorflow as tf
+
+import numpy as np
+
+from graph_ir import GraphIR, is_recv_name
 
 __author__ = 'Sayed Hadi Hashemi'
 
+# int.bit_count (Python 3.10+) avoids building a string of R digits per call; TF 1.x runs on older Pythons.
+popcount = getattr(int, "bit_count", None) or (lambda bits: bin(bits).count("1"))
+
+
+def iter_bits(bits):
+    digits = bin(bits)[:1:-1]
+    i = digits.find("1")
+    while i >= 0:
+        yield i
+        i = digits.find("1", i + 1)
+
+
 class BaseOrdering:
+    """
+    Works on a `GraphIR` (a TF tensor is exported to one first). Recv ops are numbered 0..R-1 in `self._comm_ops`
+    order and the dependencies of each comp op are kept as a bitset (a packed int, bit i set iff the op depends on
+    `self._comm_ops[i]`) in `self._deps`, aligned with `self._comp_ops`. `self._channels[i]` is the PS task the recv
+    op is sent from; recv ops of different channels are transferred concurrently.
+    """
+
     def __init__(self, target_node):
-        self._target = target_node
-        self._find_comm_dependencies()
+        self._graph = target_node if isinstance(target_node, GraphIR) else GraphIR.from_tensor(target_node)
+        self._target = self._graph.target
         self._seperate_comp_comm()
+        self._find_comm_dependencies()
+        self._channels = [self._graph.channel(op) for op in self._comm_ops]
 
-    @staticmethod
-    def _is_recv(op):
-        if op.op.name.endswith("/read"):
-            return op.op.name[:-5]
-        else:
-            return None
+    def _is_recv(self, op):
+        return self._graph.recv_name(op)
 
     def _find_comm_dependencies(self):
+        index = {op: i for i, op in enumerate(self._comm_ops)}
+        interned = {}
+        deps = {}
         stack = [self._target]
-        processed = {}
         while stack:
             op = stack.pop()
-            if processed.get(op, False):
-                deps = set()
-                for input_op in op.op.inputs:
-                    deps.update(input_op.deps)
-                op.deps = deps
+            if op in deps:
+                continue
+            if op in index:
+                deps[op] = 1 << index[op]
+                continue
+            pending = [input_op for input_op in self._graph.inputs[op] if input_op not in deps]
+            if pending:
+                stack.append(op)
+                stack.extend(pending)
             else:
-                if self._is_recv(op):
-                    op.deps = {op}
-                else:
-                    stack.append(op)
-                    for input_op in op.op.inputs:
-                        stack.append(input_op)
-                processed[op] = True
+                op_deps = 0
+                for input_op in self._graph.inputs[op]:
+                    op_deps |= deps[input_op]
+                deps[op] = interned.setdefault(op_deps, op_deps)
+        self._deps = [deps[op] for op in self._comp_ops]
 
     def _seperate_comp_comm(self):
         self._comp_ops = []
@@ -51,69 +77,240 @@ class BaseOrdering:
                     self._comm_ops.append(op)
                 else:
                     self._comp_ops.append(op)
-                    for input_op in op.op.inputs:
+                    for input_op in self._graph.inputs[op]:
                         stack.append(input_op)
                 processed[op] = True
 
+    def _dependency_groups(self):
+        groups = {}
+        for op, op_deps in zip(self._comp_ops, self._deps):
+            if op_deps:
+                groups[op_deps] = groups.get(op_deps, 0) + self._get_time(op)
+        return groups
+
     def _update_properties(self, outstanding_comm_ops):
+        self._M = [self._get_time(op) for op in self._comm_ops]
+        self._P = [0] * len(self._comm_ops)
+        self._Mp = [math.inf] * len(self._comm_ops)
 
-        for op in self._comm_ops:
-            op.P = 0
-            op.Mp = math.inf
-            op.M = self._get_time(op)
-
-        for op in self._comp_ops:
-            op_deps = op.deps.intersection(outstanding_comm_ops)
-            if len(op_deps) == 1:
-                for read in op_deps:
-                    read.P += self._get_time(op)
-            elif len(op_deps) > 1:
-                op_M = sum(self._get_time(r) for r in op_deps)
-                for read in op_deps:
-                    read.Mp = min(op_M, read.Mp)
+        for deps, time in self._dependency_groups().items():
+            op_deps = deps & outstanding_comm_ops
+            if popcount(op_deps) == 1:
+                self._P[op_deps.bit_length() - 1] += time
+            elif op_deps:
+                reads = list(iter_bits(op_deps))
+                op_M = sum(self._M[r] for r in reads)
+                for r in reads:
+                    self._Mp[r] = min(op_M, self._Mp[r])
 
     def _get_time(self, op):
         raise NotImplementedError()
 
-class TAO(BaseOrdering):
-    def __init__(self, target_node, time_oracle):
-        super().__init__(target_node)
-        self._time_oracle = time_oracle
 
-    @staticmethod
-    def _comparator(op1, op2):
-        a = min(op2.P, op1.M)
-        b = min(op1.P, op2.M)
+class _TAOEngine:
+    """
+    Incremental TAO. Keeps P/M/Mp per recv op and, when a recv op is scheduled, only updates the dependency groups
+    (comp ops sharing one dependency bitset) that were watching it.
+
+    Every group with two or more outstanding recv ops watches two of them; when a watched op is scheduled the group
+    moves the watch to another outstanding op, or, if none is left, credits its comp time to P of the last one.
+    Mp is only needed to break ties and is evaluated on demand.
+
+    The TAO comparator is Johnson's rule on (M, P), so ops are kept in a heap keyed by `(0, M)` if `M < P` else
+    `(1, -P)`. The comparator also ties ops with different keys: the head of the heap ties with every balanced op
+    (M == P) whose P is at most the head's M (if `M < P`) or P (otherwise). Balanced ops are kept in a second heap by
+    P, and among the ops tying with the head, Mp, then the key and then graph order pick. Without ties the order is
+    the one of the old sort-per-pick loop. On ties it can differ: the comparator is not transitive there, so the op
+    the old sort put first depended on how it visited the ops, and was often beaten by another one under the
+    comparator (see `bench_orderings.py --ties`).
+
+    With several channels each one has its own heap; the channel that becomes free first (in simulated transfer
+    time) picks next, so P reflects the transfers already done on all channels.
+    """
+
+    def __init__(self, recv_times, groups, channels=None):
+        self._M = list(recv_times)
+        self._channels = list(channels) if channels else [0] * len(self._M)
+        self._P = [0] * len(self._M)
+        self._outstanding = (1 << len(self._M)) - 1
+        self._watchers = [[] for _ in self._M]
+        self._deps = []
+        self._weight = []
+        self._sum = []
+        self._summed = []
+        self._watched = []
+        for deps, weight in groups:
+            g = len(self._deps)
+            self._deps.append(deps)
+            self._weight.append(weight)
+            self._sum.append(None)
+            self._summed.append(0)
+            self._watched.append([])
+            if popcount(deps) == 1:
+                self._P[deps.bit_length() - 1] += weight
+            else:
+                for r in itertools.islice(iter_bits(deps), 2):
+                    self._watch(g, r)
+        self._by_size = sorted(range(len(self._deps)), key=lambda g: popcount(self._deps[g]))
+        self._heaps = {channel: [] for channel in self._channels}
+        self._balanced = {channel: [] for channel in self._channels}
+        for r, channel in enumerate(self._channels):
+            self._heaps[channel].append((self._key(r), r))
+            if self._M[r] == self._P[r]:
+                self._balanced[channel].append((self._P[r], r))
+        for heap in itertools.chain(self._heaps.values(), self._balanced.values()):
+            heapq.heapify(heap)
+
+    def _watch(self, g, r):
+        self._watched[g].append(r)
+        self._watchers[r].append(g)
 
-        if a != b:
-            return a < b
+    def _key(self, r):
+        if self._M[r] < self._P[r]:
+            return 0, self._M[r]
         else:
-            return op1.Mp < op2.Mp
+            return 1, -self._P[r]
 
-    def _get_time(self, op):
-        if self._is_recv(op):
-            op_name = self._is_recv(op)
+    def _is_outstanding(self, r):
+        return (self._outstanding >> r) & 1
+
+    def _outstanding_sum(self, g):
+        if self._sum[g] is None:
+            self._sum[g] = sum(self._M[s] for s in iter_bits(self._deps[g] & self._outstanding))
         else:
-            op_name = op.op.name
+            scheduled = self._summed[g] & ~self._outstanding
+            self._sum[g] -= sum(self._M[s] for s in iter_bits(scheduled))
+        self._summed[g] = self._deps[g] & self._outstanding
+        return self._sum[g]
+
+    def _Mp(self, r):
+        # Groups are visited smallest first; a superset of a visited group (that still has 2+ outstanding ops) can not
+        # have a smaller sum, so it is skipped.
+        Mp = math.inf
+        bit = 1 << r
+        minimal = []
+        for g in self._by_size:
+            deps = self._deps[g]
+            if deps & bit and not any(smaller & ~deps == 0 for smaller in minimal):
+                op_deps = deps & self._outstanding
+                if op_deps & (op_deps - 1):
+                    minimal.append(deps)
+                    Mp = min(Mp, self._outstanding_sum(g))
+        return Mp
+
+    def _discard_stale(self, heap):
+        while heap:
+            key, r = heap[0]
+            if self._is_outstanding(r) and key == self._key(r):
+                return
+            heapq.heappop(heap)
+
+    def _balanced_ties(self, channel, limit):
+        """Outstanding balanced ops (M == P) of `channel` with P <= `limit`; they stay in the balanced heap."""
+        heap = self._balanced[channel]
+        ties = []
+        while heap and heap[0][0] <= limit:
+            P, r = heapq.heappop(heap)
+            if self._is_outstanding(r) and self._M[r] == self._P[r] == P:
+                ties.append((P, r))
+        for tie in ties:
+            heapq.heappush(heap, tie)
+        return [r for _, r in ties]
+
+    def _pick(self, channel):
+        heap = self._heaps[channel]
+        self._discard_stale(heap)
+        key, best = heapq.heappop(heap)
+        candidates = [best]
+        self._discard_stale(heap)
+        while heap and heap[0][0] == key:
+            candidates.append(heapq.heappop(heap)[1])
+            self._discard_stale(heap)
+        popped = list(candidates)
+        ties = self._balanced_ties(channel, self._M[best] if key[0] == 0 else self._P[best])
+        candidates.extend(r for r in ties if r not in popped)
+        if len(candidates) > 1:
+            best = min(candidates, key=lambda r: (self._Mp(r), self._key(r), r))
+        for r in popped:
+            if r != best:
+                heapq.heappush(heap, (key, r))
+        return best
+
+    def _schedule(self, r):
+        self._outstanding &= ~(1 << r)
+        for g in self._watchers[r]:
+            self._watched[g].remove(r)
+            other = self._watched[g][0]
+            rest = self._deps[g] & self._outstanding & ~(1 << other)
+            if rest:
+                self._watch(g, rest.bit_length() - 1)
+            else:
+                self._watched[g] = []
+                self._watchers[other].remove(g)
+                old_key = self._key(other)
+                self._P[other] += self._weight[g]
+                if self._key(other) != old_key:
+                    heapq.heappush(self._heaps[self._channels[other]], (self._key(other), other))
+                if self._M[other] == self._P[other]:
+                    heapq.heappush(self._balanced[self._channels[other]], (self._P[other], other))
+        self._watchers[r] = []
+
+    def order(self):
+        remaining = {channel: self._channels.count(channel) for channel in self._heaps}
+        free = [(0, channel) for channel in sorted(self._heaps)]
+        while free:
+            now, channel = heapq.heappop(free)
+            r = self._pick(channel)
+            self._schedule(r)
+            yield r
+            remaining[channel] -= 1
+            if remaining[channel]:
+                heapq.heappush(free, (now + self._M[r], channel))
+
+
+class TimedOrdering(BaseOrdering):
+    MISSING_TIME = 10
 
-        time = self._time_oracle.query(op_name)
-        if time:
-            return time
+    def __init__(self, target_node, time_oracle, statistic="min"):
+        """`statistic` picks the op durations used from the oracle: "min", "mean", "max" or a quantile in [0, 1]."""
+        super().__init__(target_node)
+        self._time_oracle = time_oracle
+        self._statistic = statistic
+        self._times = self._query_times()
+
+    def _query_times(self):
+        """Durations of all comp and recv ops, looked up at once; ops missing from the oracle are reported together."""
+        ops = self._comp_ops + self._comm_ops
+        names = [self._is_recv(op) or self._graph.op_name(op) for op in ops]
+        if hasattr(self._time_oracle, "query_many"):
+            times = self._time_oracle.query_many(names, self._statistic)
         else:
-            print("// >>> Error (Server-Client version mismatch?): {}".format(op_name))
-            return 10
+            times = np.array([self._time_oracle.query(name, self._statistic) for name in names], dtype=np.float64)
+        missing = np.isnan(times) | (times == 0)
+        if missing.any():
+            missed = [name for name, miss in zip(names, missing) if miss]
+            print("// >>> Error (Server-Client version mismatch?): {} of {} ops not in the time oracle: {}{}".format(
+                len(missed), len(names), ", ".join(missed[:5]), ", ..." if len(missed) > 5 else ""))
+            times[missing] = self.MISSING_TIME
+        return dict(zip(ops, times.tolist()))
+
+    def _get_time(self, op):
+        return self._times[op]
+
+
+class TAO(TimedOrdering):
+    def _get_engine(self):
+        return _TAOEngine([self._get_time(op) for op in self._comm_ops], self._dependency_groups().items(),
+                          self._channels)
 
     @lru_cache()
     def get_priorities(self):
-        outstanding_comm_ops = list(self._comm_ops)
+        # Priorities are counted per channel: each PS link follows its own order.
+        counters = collections.Counter()
         priorities = []
-        counter = 0
-        while outstanding_comm_ops:
-            self._update_properties(outstanding_comm_ops)
-            outstanding_comm_ops.sort(key=utils.cmp_to_key(self._comparator))
-            priorities.append((counter, outstanding_comm_ops[0]))
-            counter += 1
-            del outstanding_comm_ops[0]
+        for r in self._get_engine().order():
+            priorities.append((counters[self._channels[r]], self._graph.op_name(self._comm_ops[r])))
+            counters[self._channels[r]] += 1
         return priorities
 
 
@@ -127,16 +324,43 @@ class TIO(BaseOrdering):
 
     @lru_cache()
     def get_priorities(self):
-        outstanding_comm_ops = list(self._comm_ops)
-        self._update_properties(outstanding_comm_ops)
+        self._update_properties((1 << len(self._comm_ops)) - 1)
         priorities = []
-        counter = 0
-        last_counter = -1
-        last_Mp = -1
-        for op in sorted(outstanding_comm_ops, key=lambda recv_op: recv_op.Mp):
-            if last_Mp < op.Mp:
-                last_counter = counter
-                last_Mp = op.Mp
-            priorities.append((last_counter, op))
-            counter += 1
+        counter = collections.Counter()
+        last_counter = {}
+        last_Mp = collections.defaultdict(lambda: -1)
+        for r in sorted(range(len(self._comm_ops)), key=lambda recv_op: self._Mp[recv_op]):
+            channel = self._channels[r]
+            if last_Mp[channel] < self._Mp[r]:
+                last_counter[channel] = counter[channel]
+                last_Mp[channel] = self._Mp[r]
+            priorities.append((last_counter[channel], self._graph.op_name(self._comm_ops[r])))
+            counter[channel] += 1
         return priorities
+
+
+def send_priorities(sends, recv_priorities):
+    """
+    Priorities of the gradient sends (gradient op, variable op) of the train stage. A variable's update on the PS has to
+    finish before the variable is read again in the next iteration, so sends are ordered by the read priority of their
+    variable (earliest deadline first); sends of variables without a read priority come last.
+    """
+    read_priority = {name[:-5] if is_recv_name(name) else name: counter for counter, name in recv_priorities}
+    last = max(read_priority.values(), default=-1) + 1
+    return [(read_priority.get(variable, last), gradient) for gradient, variable in sends]
+
+
+def priority_print(priority_dict):
+    ret = "std::unordered_map<std::string, int> rpc_list = \n{\n"
+    first = True
+    for name, priority in priority_dict.items():
+        if first:
+            first = False
+        else:
+            ret += ",\n\n"
+        ret += "// {}\n".format(name)
+        ret += ",\n".join(
+            ['{"%s", %s}' % (row[1][:-5] if is_recv_name(row[1]) else row[1], row[0])
+             for row in sorted(priority, key=lambda x: x[0])])
+    ret += "\n\n};"
+    return ret